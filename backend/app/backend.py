@@ -2,79 +2,390 @@
 Backend: API endpoints para frontend
 """
 
+import io
+import csv
 import json
+import asyncio
+import threading
+import weakref
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from typing import Optional
-from fastapi import FastAPI
-from app.db import ensure_tables, get_conn
-from psycopg2.extras import RealDictCursor
+from typing import List, Optional
+from fastapi import FastAPI, Request, Response, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.settings import (
+    READINGS_PAGE_SIZE, READINGS_PAGE_MAX, EXPORT_CHUNK_ROWS, EXPORT_MAX_CONCURRENT, ROLLUP_MAX_POINTS
+)
+from app.rollups import pick_bucket, bucket_start
+from app.latest import get_version, LATEST_VERSION
+from app.forecast import forecast_body, FORECAST_VERSION
+from app.db import get_conn, connect, listen, pool_stats, DatabaseUnavailable, TimedRealDictCursor
+from app.metrics import instrument
+from app.live import hub
+from app import zones
+from app.migrate import check_schema
 
-ensure_tables()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    check_schema()
+    hub.start(asyncio.get_running_loop())
+    listen(zones.ZONES_CHANNEL, zones.invalidate)
+    yield
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+instrument(app)
+
+@app.exception_handler(DatabaseUnavailable)
+def database_unavailable(request: Request, exc: DatabaseUnavailable):
+    return JSONResponse(status_code=503, content={"error": "Database unavailable"})
+
+@app.get("/api/stats/db")
+def db_stats():
+    return pool_stats()
+
+# Columns that can be requested through ?fields=; id and timestamp are always
+# returned because the pagination cursor is built from them
+READING_COLUMNS = {
+    "id": "cr.id",
+    "container_id": "cr.container_id",
+    "timestamp": "cr.timestamp",
+    "fill_level": "cr.fill_level",
+    "received_at": "cr.received_at",
+    "node_id": "c.node_id",
+    "zone_id": "c.zone_id",
+    "lon": "ST_X(c.location::geometry)",
+    "lat": "ST_Y(c.location::geometry)",
+}
+DEFAULT_READING_FIELDS = ["id", "container_id", "timestamp", "fill_level", "received_at", "lon", "lat"]
+# Same for every reading of a container; ?format=columnar sends them once per container
+CONTAINER_FIELDS = ("node_id", "zone_id", "lon", "lat")
+
+def reading_fields(fields: Optional[str]) -> list[str]:
+    names = DEFAULT_READING_FIELDS if not fields else ["id", "timestamp"] + [
+        f for f in fields.split(",") if f not in ("id", "timestamp")
+    ]
+    unknown = [name for name in names if name not in READING_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+def reading_columns(names: list[str]) -> str:
+    return ", ".join(f"{READING_COLUMNS[name]} AS {name}" for name in names)
+
+def parse_bbox(bbox: str) -> list[float]:
+    """bbox=<min lon>,<min lat>,<max lon>,<max lat> in WGS 84 degrees."""
+    try:
+        values = [float(v) for v in bbox.split(",")]
+    except ValueError:
+        values = []
+    if len(values) != 4 or values[0] > values[2] or values[1] > values[3]:
+        raise ValueError("Invalid bbox. Use bbox=<min lon>,<min lat>,<max lon>,<max lat>.")
+    # Written so NaN fails too
+    if not all(-180 <= lon <= 180 for lon in values[0::2]) or not all(-90 <= lat <= 90 for lat in values[1::2]):
+        raise ValueError("Invalid bbox. Longitudes must be within [-180, 180] and latitudes within [-90, 90].")
+    return values
+
+def bbox_condition(column: str, bbox: str) -> tuple[str, list]:
+    # && on the geography column is answered from its GIST index (idx_containers_location)
+    return f"{column} && ST_MakeEnvelope(%s, %s, %s, %s, 4326)::geography", parse_bbox(bbox)
+
+def reading_filters(
+    timestamp: Optional[str],
+    range_seconds: int,
+    container_id: Optional[str],
+    zone_id: Optional[str],
+    node_id: Optional[str],
+    bbox: Optional[str] = None,
+):
+    conditions = []
+    params = []
+
+    if timestamp:
+        try:
+            ts = datetime.fromisoformat(timestamp)
+        except ValueError:
+            raise ValueError("Invalid timestamp format. Use ISO8601.")
+
+        conditions.append("cr.timestamp BETWEEN %s AND %s")
+        params += [ts - timedelta(seconds=range_seconds), ts + timedelta(seconds=range_seconds)]
+
+    for column, value in (("cr.container_id", container_id), ("c.zone_id", zone_id), ("c.node_id", node_id)):
+        if value:
+            conditions.append(f"{column} = %s")
+            params.append(value)
+
+    if bbox:
+        condition, values = bbox_condition("c.location", bbox)
+        conditions.append(condition)
+        params += values
+
+    return conditions, params
+
+def parse_cursor(after: str):
+    """Cursor format: <ISO8601 timestamp>,<id> of the last row of the previous page."""
+    try:
+        ts, row_id = after.rsplit(",", 1)
+        return datetime.fromisoformat(ts), int(row_id)
+    except ValueError:
+        raise ValueError("Invalid cursor. Use after=<timestamp>,<id> from X-Next-Cursor.")
+
+def columnar(names: list[str], rows: list[tuple]) -> dict:
+    """{"count", "columns": {name: [values]}}, transposing the cursor rows in one pass."""
+    values = zip(*rows) if rows else [()] * len(names)
+    return {"count": len(rows), "columns": dict(zip(names, values))}
+
+def container_table(cur, fields: list[str], container_ids) -> dict:
+    """{container_id: {field: value}} for the containers of a columnar page."""
+    columns = ", ".join(READING_COLUMNS[name] for name in fields)
+    cur.execute(f"SELECT c.id, {columns} FROM containers c WHERE c.id = ANY(%s)", (list(set(container_ids)),))
+    return {row[0]: dict(zip(fields, row[1:])) for row in cur.fetchall()}
+
+def dumps(content) -> bytes:
+    return json.dumps(content, default=_format_value, separators=(",", ":")).encode()
 
 @app.get("/api/readings")
 def list_readings(
+    response: Response,
     timestamp: Optional[str] = None,
-    range_seconds: int = 600  # Default to ±5 minutes
+    range_seconds: int = 600,  # Default to ±5 minutes
+    after: Optional[str] = None,
+    limit: int = Query(READINGS_PAGE_SIZE, ge=1, le=READINGS_PAGE_MAX),
+    container_id: Optional[str] = None,
+    zone_id: Optional[str] = None,
+    node_id: Optional[str] = None,
+    bbox: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: str = Query("rows", pattern="^(rows|columnar)$"),
 ):
+    """
+    Newest readings first, one page at a time. When the page is full the
+    X-Next-Cursor header holds the value to pass as ?after= for the next one.
+    ?format=columnar returns one array per field instead of one object per
+    reading, with node, zone and coordinates in a per-container side table.
+    """
+    try:
+        names = reading_fields(fields)
+        container_fields = []
+        if format == "columnar":
+            container_fields = [name for name in names if name in CONTAINER_FIELDS]
+            names = [name for name in names if name not in CONTAINER_FIELDS]
+            if container_fields and "container_id" not in names:
+                names.append("container_id")
+        columns = reading_columns(names)
+        conditions, params = reading_filters(timestamp, range_seconds, container_id, zone_id, node_id, bbox)
+        if after:
+            conditions.append("(cr.timestamp, cr.id) < (%s, %s)")
+            params += list(parse_cursor(after))
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
     with get_conn() as conn:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        # Columnar pages are built from plain tuples, without a dict per row
+        cur = conn.cursor(cursor_factory=TimedRealDictCursor) if format == "rows" else conn.cursor()
 
-        sql = """
-            SELECT 
-                cr.container_id, 
-                cr.timestamp, 
-                cr.fill_level, 
-                cr.received_at,
-                ST_X(c.location::geometry) AS lon,
-                ST_Y(c.location::geometry) AS lat
+        sql = f"""
+            SELECT {columns}
             FROM container_readings cr
             JOIN containers c ON cr.container_id = c.id
         """
-        params = []
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
 
-        if timestamp:
-            try:
-                ts = datetime.fromisoformat(timestamp)
-            except ValueError:
-                return {"error": "Invalid timestamp format. Use ISO8601."}
+        sql += " ORDER BY cr.timestamp DESC, cr.id DESC LIMIT %s"
+        params.append(limit)
 
-            start_time = ts - timedelta(seconds=range_seconds)
-            end_time = ts + timedelta(seconds=range_seconds)
+        cur.execute(sql, params)
+        rows = cur.fetchall()
 
-            sql += " WHERE cr.timestamp BETWEEN %s AND %s"
-            params += [start_time, end_time]
+        if format == "columnar":
+            content = columnar(names, rows)
+            if container_fields:
+                content["containers"] = container_table(cur, container_fields, content["columns"]["container_id"])
 
-        sql += " ORDER BY cr.timestamp DESC"
+    if format == "rows":
+        if len(rows) == limit:
+            last = rows[-1]
+            response.headers["X-Next-Cursor"] = f"{last['timestamp'].isoformat()},{last['id']}"
+        return rows
 
-        cur.execute(sql, params)
-        return cur.fetchall()
+    headers = {}
+    if len(rows) == limit:
+        last = rows[-1]
+        headers["X-Next-Cursor"] = f"{last[names.index('timestamp')].isoformat()},{last[names.index('id')]}"
+    return Response(dumps(content), media_type="application/json", headers=headers)
 
-@app.get("/api/zones")
-def list_zones():
-    with get_conn() as conn:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
-            SELECT 
-                id, 
-                name,
-                ST_AsGeoJSON(boundary::geometry) AS geojson
-            FROM zones;
-        """)
-        zones = cur.fetchall()
+def _format_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+# Exports can run for minutes: each one gets its own connection instead of
+# holding a pooled one, and only EXPORT_MAX_CONCURRENT run at once
+export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
 
-        # Deserialize GeoJSON string into actual object
-        for zone in zones:
-            zone["boundary"] = json.loads(zone.pop("geojson"))
+def stream_readings(sql: str, params: list, fmt: str):
+    # Server-side (named) cursor: rows are pulled from PostgreSQL in chunks,
+    # so memory stays flat whatever the size of the export
+    conn = connect()
+    try:
+        with conn.cursor(name="readings_export") as cur:
+            cur.itersize = EXPORT_CHUNK_ROWS
+            cur.execute(sql, params)
+            header = None
+            while True:
+                rows = cur.fetchmany(EXPORT_CHUNK_ROWS)
+                if not rows:
+                    break
+                if header is None:
+                    header = [column.name for column in cur.description]
+                    if fmt == "csv":
+                        yield ",".join(header) + "\n"
 
-        return zones
+                if fmt == "csv":
+                    buffer = io.StringIO()
+                    writer = csv.writer(buffer, lineterminator="\n")
+                    writer.writerows([[_format_value(v) for v in row] for row in rows])
+                    yield buffer.getvalue()
+                else:
+                    yield "".join(
+                        json.dumps({k: _format_value(v) for k, v in zip(header, row)}) + "\n"
+                        for row in rows
+                    )
+    finally:
+        conn.close()
+
+def release_after(stream, release: weakref.finalize):
+    """Frees the export slot as soon as the stream ends; finalize covers streams never started."""
+    try:
+        yield from stream
+    finally:
+        release()
+
+@app.get("/api/readings/export")
+def export_readings(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    timestamp: Optional[str] = None,
+    range_seconds: int = 600,
+    container_id: Optional[str] = None,
+    zone_id: Optional[str] = None,
+    node_id: Optional[str] = None,
+    bbox: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """Every matching reading, oldest first, streamed as NDJSON or CSV; 503 while EXPORT_MAX_CONCURRENT run."""
+    try:
+        columns = reading_columns(reading_fields(fields))
+        conditions, params = reading_filters(timestamp, range_seconds, container_id, zone_id, node_id, bbox)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    sql = f"""
+        SELECT {columns}
+        FROM container_readings cr
+        JOIN containers c ON cr.container_id = c.id
+    """
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY cr.timestamp, cr.id"
+
+    if not export_slots.acquire(blocking=False):
+        return JSONResponse(status_code=503, content={"error": "Too many exports running, retry later"},
+                            headers={"Retry-After": "10"})
+    stream = stream_readings(sql, params, format)
+    release = weakref.finalize(stream, export_slots.release)
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        release_after(stream, release),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="readings.{format}"'},
+    )
+
+@app.get("/api/readings/rollup")
+def list_rollups(
+    bucket: str = Query("auto", pattern="^(auto|1m|1h|1d)$"),
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    container_id: Optional[str] = None,
+    zone_id: Optional[str] = None,
+    node_id: Optional[str] = None,
+):
+    """
+    Pre-aggregated fill levels per container. Defaults to the last 24 hours;
+    bucket=auto picks the finest resolution keeping each series under
+    ROLLUP_MAX_POINTS points.
+    """
+    try:
+        end_time = datetime.fromisoformat(end) if end else datetime.now()
+        start_time = datetime.fromisoformat(start) if start else end_time - timedelta(days=1)
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Invalid from/to format. Use ISO8601."})
+
+    if bucket == "auto":
+        bucket = pick_bucket(start_time, end_time, ROLLUP_MAX_POINTS)
+
+    sql = """
+        SELECT
+            r.container_id,
+            r.bucket_start,
+            r.min_level,
+            r.max_level,
+            r.sum_level / r.count AS avg_level,
+            r.count,
+            r.last_level,
+            r.last_timestamp
+        FROM container_rollups r
+        JOIN containers c ON r.container_id = c.id
+        WHERE r.bucket = %s AND r.bucket_start >= %s AND r.bucket_start < %s
+    """
+    params = [bucket, bucket_start(start_time, bucket), end_time]
+    for column, value in (("r.container_id", container_id), ("c.zone_id", zone_id), ("c.node_id", node_id)):
+        if value:
+            sql += f" AND {column} = %s"
+            params.append(value)
+    sql += " ORDER BY r.container_id, r.bucket_start"
+
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=TimedRealDictCursor)
+        cur.execute(sql, params)
+        return {"bucket": bucket, "from": start_time, "to": end_time, "rows": cur.fetchall()}
+
+@app.get("/api/zones")
+def list_zones(request: Request, zoom: Optional[int] = Query(None, ge=0)):
+    """
+    Every zone with its boundary as GeoJSON. With ?zoom= (map zoom level) the
+    boundaries are simplified to about one pixel at that zoom. Supports
+    If-None-Match.
+    """
+    etag, body = zones.get_zones(zoom)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.get("/api/containers")
-def list_containers():
+def list_containers(
+    zone_id: Optional[str] = None,
+    node_id: Optional[str] = None,
+    bbox: Optional[str] = None,
+    format: str = Query("rows", pattern="^(rows|columnar)$"),
+):
+    conditions = []
+    params = []
+    for column, value in (("zone_id", zone_id), ("node_id", node_id)):
+        if value:
+            conditions.append(f"{column} = %s")
+            params.append(value)
+    if bbox:
+        try:
+            condition, values = bbox_condition("location", bbox)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        conditions.append(condition)
+        params += values
+
     with get_conn() as conn:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("""
+        cur = conn.cursor(cursor_factory=TimedRealDictCursor) if format == "rows" else conn.cursor()
+        sql = """
             SELECT 
                 id,
                 node_id,
@@ -83,6 +394,75 @@ def list_containers():
                 created_at,
                 ST_X(location::geometry) AS lon,
                 ST_Y(location::geometry) AS lat
-            FROM containers;
-        """)
-        return cur.fetchall()
\ No newline at end of file
+            FROM containers
+        """
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+
+    if format == "rows":
+        return rows
+    content = columnar([column.name for column in cur.description], rows)
+    return Response(dumps(content), media_type="application/json")
+
+@app.get("/api/containers/latest")
+def list_latest(
+    request: Request,
+    zone_id: Optional[str] = None,
+    node_id: Optional[str] = None,
+):
+    """Current fill level of every container. Supports If-None-Match."""
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=TimedRealDictCursor)
+        etag = f'W/"latest-{get_version(conn.cursor(), LATEST_VERSION)}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+
+        sql = """
+            SELECT container_id, node_id, zone_id, fill_level, timestamp, received_at, lon, lat
+            FROM container_latest
+        """
+        conditions = []
+        params = []
+        for column, value in (("zone_id", zone_id), ("node_id", node_id)):
+            if value:
+                conditions.append(f"{column} = %s")
+                params.append(value)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY container_id"
+
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+
+    return JSONResponse(content=jsonable_encoder(rows), headers=headers)
+
+@app.get("/api/containers/forecast")
+def list_forecast(request: Request):
+    """
+    Fill rate (points per hour) and predicted full time of every container,
+    fitted since its last emptying. Supports If-None-Match.
+    """
+    with get_conn() as conn:
+        version = get_version(conn.cursor(), FORECAST_VERSION)
+        etag = f'W/"forecast-{version}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        body = forecast_body(conn, version)
+    return Response(body, media_type="application/json", headers=headers)
+
+@app.get("/api/live")
+def live(zone_id: Optional[List[str]] = Query(None)):
+    """
+    Server-sent events with container_latest rows as they change, optionally
+    only for some zones. Clients subscribe first and then load
+    /api/containers/latest, keeping the newest timestamp of each container.
+    """
+    return StreamingResponse(
+        hub.stream(set(zone_id) if zone_id else None),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,29 +1,291 @@
+import os
+import re
 import time
+import select
+import threading
+from contextlib import contextmanager
 import psycopg2
-from app.settings import DB_HOST, DB_NAME, DB_USER, DB_PASS, DB_PORT
+from psycopg2 import sql
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, ISOLATION_LEVEL_AUTOCOMMIT, cursor as Cursor
+from psycopg2.extras import RealDictCursor
+from app.settings import (
+    DB_HOST, DB_NAME, DB_USER, DB_PASS, DB_PORT,
+    DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_MAX_IDLE,
+    DB_POOL_HEALTHCHECK_IDLE, DB_CONNECT_TIMEOUT
+)
+from app.metrics import Gauge, Histogram
 
-def get_conn(retires=5):
+query_seconds = Histogram("sced_db_query_seconds", "Duration of each statement by SQL command", ("command",))
+acquire_seconds = Histogram("sced_db_acquire_seconds", "Wait for a pooled connection")
+transaction_seconds = Histogram("sced_db_transaction_seconds", "Time a connection is borrowed from the pool")
+
+class DatabaseUnavailable(Exception):
+    """No connection to PostgreSQL could be established."""
+
+class PoolTimeout(DatabaseUnavailable):
+    """Every pooled connection stayed busy for longer than the acquire timeout."""
+
+class Timed:
+    """Cursor mixin observing every statement in sced_db_query_seconds (execute_values runs through execute)."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            query_seconds.observe(time.perf_counter() - started, _command(query))
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            query_seconds.observe(time.perf_counter() - started, _command(query))
+
+class TimedCursor(Timed, Cursor):
+    pass
+
+class TimedRealDictCursor(Timed, RealDictCursor):
+    pass
+
+# First keyword after any leading comments, so the label has a handful of values
+SQL_COMMAND = re.compile(r"\s*(?:--[^\n]*\n\s*)*(\w+)")
+
+def _command(query) -> str:
+    if isinstance(query, bytes):
+        query = query[:200].decode(errors="replace")
+    elif isinstance(query, sql.Composable):
+        # Built with psycopg2.sql (DDL in partitions.py); rendering it needs the connection
+        return "COMPOSED"
+    match = SQL_COMMAND.match(query)
+    return match.group(1).upper() if match else "OTHER"
+
+def connect():
+    try:
+        return psycopg2.connect(
+            host=DB_HOST,
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASS,
+            port=DB_PORT,
+            connect_timeout=DB_CONNECT_TIMEOUT,
+            cursor_factory=TimedCursor
+        )
+    except psycopg2.OperationalError as e:
+        raise DatabaseUnavailable(str(e)) from e
+
+# --- Connection pool ---
+class ConnectionPool:
+    """Thread-safe pool with bounded acquire waits and idle health checks."""
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._idle = []  # (conn, released_at), most recently used last
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self._acquired = 0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._acquire_total = 0.0
+        self._acquire_max = 0.0
+
+    def acquire(self, timeout: float | None = None):
+        started = time.perf_counter()
+        deadline = started + (self.timeout if timeout is None else timeout)
+        conn = None
+        released_at = None
+
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        conn, released_at = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+        try:
+            if conn is None:
+                conn = connect()
+            elif not self._healthy(conn, released_at):
+                self._close(conn)
+                self._reconnects += 1
+                conn = connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.perf_counter() - started
+        with self._cond:
+            self._in_use += 1
+            self._acquired += 1
+            self._acquire_total += elapsed
+            self._acquire_max = max(self._acquire_max, elapsed)
+        acquire_seconds.observe(elapsed)
+        return conn
+
+    def release(self, conn):
+        if not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self._close(conn)
+
+        now = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            if conn.closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, now))
+            self._prune(now)
+            self._cond.notify()
+
+    def _healthy(self, conn, released_at: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < DB_POOL_HEALTHCHECK_IDLE:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _prune(self, now: float):
+        # Close connections idle for too long, oldest first, keeping minconn around
+        while self._idle and self._size > self.minconn and now - self._idle[0][1] > DB_POOL_MAX_IDLE:
+            conn, _ = self._idle.pop(0)
+            self._close(conn)
+            self._size -= 1
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "max": self.maxconn,
+                "acquired": self._acquired,
+                "timeouts": self._timeouts,
+                "reconnects": self._reconnects,
+                "acquire_avg_ms": 1000 * self._acquire_total / self._acquired if self._acquired else 0.0,
+                "acquire_max_ms": 1000 * self._acquire_max,
+            }
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    global _pool, _pool_pid
+    # Connections must not be shared with forked child processes
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT)
+                _pool_pid = os.getpid()
+    return _pool
+
+def pool_stats() -> dict:
+    return get_pool().stats()
+
+Gauge("sced_db_pool_connections", "Pooled connections by state", ("state",), collect=lambda: {
+    (state,): value for state, value in pool_stats().items() if state in ("idle", "in_use", "waiting")
+})
+
+@contextmanager
+def get_conn(retries=1, timeout=None):
+    """
+    Borrow a pooled connection. Commits on success, rolls back on error and
+    always returns the connection to the pool.
+    """
+    pool = get_pool()
     attempt = 1
-    while attempt < retires:
+    while True:
         try:
-            return psycopg2.connect(
-                host=DB_HOST,
-                dbname=DB_NAME,
-                user=DB_USER,
-                password=DB_PASS,
-                port=DB_PORT
-            )
-        except:
-            print(f"Failed to connect to DB ({attempt}/{retires})")
-        attempt += 1
-        time.sleep(5)
-
-# --- Load and execute SQL from file ---
-def ensure_tables(sql_path="schema.sql"):
-    with open(sql_path, 'r') as f:
-        schema_sql = f.read()
-
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(schema_sql)
-        conn.commit()
+            conn = pool.acquire(timeout)
+            break
+        except PoolTimeout:
+            raise
+        except DatabaseUnavailable as e:
+            if attempt >= retries:
+                raise
+            delay = min(0.5 * 2 ** (attempt - 1), 5)
+            print(f"Failed to connect to DB ({attempt}/{retries}): {e}")
+            attempt += 1
+            time.sleep(delay)
+
+    borrowed = time.perf_counter()
+    try:
+        yield conn
+        if not conn.closed:
+            conn.commit()
+    except Exception:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        raise
+    finally:
+        pool.release(conn)
+        transaction_seconds.observe(time.perf_counter() - borrowed)
+
+# --- LISTEN/NOTIFY ---
+def listen(channel: str, callback, reconnect_delay=5):
+    """
+    Call callback(payload) for every NOTIFY on channel, from a daemon thread
+    holding its own (unpooled) connection. callback(None) is called after each
+    (re)connect, since notifications sent while disconnected are lost.
+    """
+    def run():
+        while True:
+            conn = None
+            try:
+                conn = connect()
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+                callback(None)
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        callback(conn.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"LISTEN {channel} failed, retrying in {reconnect_delay}s: {e}")
+            finally:
+                if conn is not None:
+                    ConnectionPool._close(conn)
+            time.sleep(reconnect_delay)
+
+    thread = threading.Thread(target=run, name=f"listen-{channel}", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,239 @@
+"""
+Forecast: tasa de llenado y hora estimada de llenado por contenedor
+
+Each container keeps a least-squares fit of fill_level against time since
+its last emptying, stored as running sums in container_forecast. The worker
+folds every batch into it, so the cost follows new readings, not history.
+A drop of more than FORECAST_EMPTY_DROP points starts a new cycle. The
+worker's maintenance loop rebuilds every state from the last
+FORECAST_LOOKBACK_DAYS of readings in one SQL pass, which also corrects
+drift from late readings. Forecasts are published rounded (rate to 0.01
+points per hour, full time to the minute) and the version that invalidates
+/api/containers/forecast only changes when a published value does. To run
+the rebuild by hand:
+
+    python -m app.forecast
+"""
+
+import json
+import threading
+from datetime import datetime, timedelta
+from psycopg2.extras import execute_values
+from app.db import get_conn
+from app.latest import bump_version
+from app.settings import (
+    FORECAST_FULL_LEVEL, FORECAST_EMPTY_DROP, FORECAST_MIN_READINGS, FORECAST_LOOKBACK_DAYS
+)
+
+FORECAST_VERSION = "container_forecast"
+# Slower fills are reported without a predicted time
+MAX_HORIZON = timedelta(days=365)
+STATE_COLUMNS = ("cycle_start", "n", "sum_t", "sum_y", "sum_tt", "sum_ty", "last_level", "last_timestamp")
+
+# --- Regression state ---
+def fold(state: tuple, points: list[tuple[datetime, float]]) -> tuple:
+    """Add (timestamp, fill_level) points, oldest first, to a state as in STATE_COLUMNS."""
+    cycle_start, n, sum_t, sum_y, sum_tt, sum_ty, last_level, last_timestamp = state
+    for ts, level in points:
+        if last_timestamp is None or (ts > last_timestamp and level < last_level - FORECAST_EMPTY_DROP):
+            cycle_start, n, sum_t, sum_y, sum_tt, sum_ty = ts, 0, 0.0, 0.0, 0.0, 0.0
+        elif ts < cycle_start:
+            # Late reading from before the last emptying
+            continue
+        t = (ts - cycle_start).total_seconds()
+        n += 1
+        sum_t += t
+        sum_y += level
+        sum_tt += t * t
+        sum_ty += t * level
+        if last_timestamp is None or ts >= last_timestamp:
+            last_level, last_timestamp = level, ts
+    return cycle_start, n, sum_t, sum_y, sum_tt, sum_ty, last_level, last_timestamp
+
+def predict(state: tuple) -> tuple[float | None, datetime | None]:
+    """(fill rate in points per hour, predicted full time) as published, None where unknown."""
+    rate, full_at = _predict(state)
+    return (
+        round(rate, 2) if rate is not None else None,
+        full_at.replace(second=0, microsecond=0) if full_at is not None else None,
+    )
+
+def _predict(state: tuple) -> tuple[float | None, datetime | None]:
+    cycle_start, n, sum_t, sum_y, sum_tt, sum_ty, last_level, last_timestamp = state
+    rate = slope = None
+    denominator = n * sum_tt - sum_t ** 2
+    if n >= FORECAST_MIN_READINGS and denominator > 0:
+        slope = (n * sum_ty - sum_t * sum_y) / denominator
+        rate = slope * 3600
+    if last_level is not None and last_level >= FORECAST_FULL_LEVEL:
+        return rate, last_timestamp
+    if slope is None or slope <= 0:
+        return rate, None
+    intercept = (sum_y - slope * sum_t) / n
+    seconds = (FORECAST_FULL_LEVEL - intercept) / slope
+    if seconds > (last_timestamp - cycle_start + MAX_HORIZON).total_seconds():
+        return rate, None
+    # Never before the newest reading, which was still below full
+    return rate, max(cycle_start + timedelta(seconds=seconds), last_timestamp)
+
+def published(state: tuple) -> tuple:
+    """What /api/containers/forecast shows of a state; bump the version only when it changes."""
+    return (state[0], *predict(state)) if state[1] else None
+
+def update_forecast(cur, readings: list[dict]) -> int:
+    """
+    Fold a batch of readings into the states of their containers. Returns the
+    number of published forecasts that changed; the caller then bumps
+    FORECAST_VERSION as the last statement of its transaction.
+    """
+    points = {}
+    for r in readings:
+        points.setdefault(r["container_id"], []).append((r["timestamp"], r["fill_level"]))
+    if not points:
+        return 0
+    container_ids = sorted(points)
+
+    execute_values(cur, """
+        INSERT INTO container_forecast (container_id) VALUES %s ON CONFLICT (container_id) DO NOTHING
+    """, [(container_id,) for container_id in container_ids])
+    # Sorted so concurrent workers lock rows in the same order
+    cur.execute(f"""
+        SELECT container_id, {", ".join(STATE_COLUMNS)}
+        FROM container_forecast
+        WHERE container_id = ANY(%s)
+        ORDER BY container_id
+        FOR UPDATE
+    """, (container_ids,))
+    rows = []
+    changed = 0
+    for container_id, *state in cur.fetchall():
+        new_state = fold(tuple(state), sorted(points[container_id]))
+        if new_state != tuple(state):
+            rows.append((container_id, *new_state))
+            changed += published(new_state) != published(tuple(state))
+    if not rows:
+        return 0
+    execute_values(cur, f"""
+        UPDATE container_forecast AS f SET
+            {", ".join(f"{column} = v.{column}" for column in STATE_COLUMNS)},
+            updated_at = now()
+        FROM (VALUES %s) AS v (container_id, {", ".join(STATE_COLUMNS)})
+        WHERE f.container_id = v.container_id
+    """, rows, template="(%s, %s::timestamp, %s, %s::float8, %s::float8, %s::float8, %s::float8, %s::float8, %s::timestamp)",
+        page_size=len(rows))
+    return changed
+
+# --- Periodic recompute ---
+def recompute(cur, now: datetime | None = None) -> int:
+    """Rebuild the state of every container with readings in the lookback window."""
+    since = (now or datetime.now()) - timedelta(days=FORECAST_LOOKBACK_DAYS)
+    # The scan runs without blocking the workers. The forecast rows read in the
+    # same snapshot tell, at merge time, which containers a batch was folded
+    # into meanwhile: those keep their incremental state until the next pass.
+    cur.execute("""
+        CREATE TEMP TABLE forecast_rebuild ON COMMIT DROP AS
+        WITH r AS (
+            SELECT container_id, timestamp, fill_level,
+                   fill_level < lag(fill_level) OVER (PARTITION BY container_id ORDER BY timestamp, id) - %s AS emptied
+            FROM container_readings
+            WHERE timestamp >= %s
+        ),
+        cycles AS (
+            SELECT container_id, COALESCE(max(timestamp) FILTER (WHERE emptied), min(timestamp)) AS cycle_start
+            FROM r
+            GROUP BY container_id
+        ),
+        points AS (
+            SELECT r.container_id, c.cycle_start, r.timestamp, r.fill_level AS y,
+                   extract(epoch FROM r.timestamp - c.cycle_start)::float8 AS t
+            FROM r
+            JOIN cycles c ON c.container_id = r.container_id
+            WHERE r.timestamp >= c.cycle_start
+        ),
+        rebuilt AS (
+            SELECT container_id, cycle_start, count(*)::int AS n, sum(t) AS sum_t, sum(y) AS sum_y,
+                   sum(t * t) AS sum_tt, sum(t * y) AS sum_ty,
+                   (array_agg(y ORDER BY timestamp DESC))[1] AS last_level, max(timestamp) AS last_timestamp
+            FROM points
+            GROUP BY container_id, cycle_start
+        )
+        SELECT b.*, f.container_id IS NOT NULL AS seen, f.updated_at AS seen_updated_at
+        FROM rebuilt b
+        LEFT JOIN container_forecast f ON f.container_id = b.container_id
+    """, (FORECAST_EMPTY_DROP, since))
+
+    # Only the merge blocks the workers
+    cur.execute("LOCK TABLE container_forecast IN EXCLUSIVE MODE")
+    cur.execute(f"""
+        SELECT f.container_id, {", ".join(f"f.{column}" for column in STATE_COLUMNS)},
+               {", ".join(f"b.{column}" for column in STATE_COLUMNS)}
+        FROM container_forecast f
+        JOIN forecast_rebuild b ON b.container_id = f.container_id
+        WHERE b.seen AND f.updated_at = b.seen_updated_at
+          AND ({", ".join(f"f.{column}" for column in STATE_COLUMNS)})
+              IS DISTINCT FROM ({", ".join(f"b.{column}" for column in STATE_COLUMNS)})
+    """)
+    width = len(STATE_COLUMNS)
+    changed = [(row[0], row[1:1 + width], row[1 + width:]) for row in cur.fetchall()]
+    if changed:
+        cur.execute(f"""
+            UPDATE container_forecast AS f SET
+                {", ".join(f"{column} = b.{column}" for column in STATE_COLUMNS)},
+                updated_at = now()
+            FROM forecast_rebuild b
+            WHERE f.container_id = b.container_id AND f.container_id = ANY(%s)
+        """, ([container_id for container_id, _, _ in changed],))
+    cur.execute(f"""
+        INSERT INTO container_forecast (container_id, {", ".join(STATE_COLUMNS)})
+        SELECT container_id, {", ".join(STATE_COLUMNS)} FROM forecast_rebuild WHERE NOT seen
+        ON CONFLICT (container_id) DO NOTHING
+        RETURNING container_id
+    """)
+    inserted = len(cur.fetchall())
+
+    if inserted or any(published(old) != published(new) for _, old, new in changed):
+        bump_version(cur, FORECAST_VERSION)
+    return len(changed) + inserted
+
+def run_recompute() -> int:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            return recompute(cur)
+
+# --- API ---
+_cached = (None, b"")  # (version, JSON body)
+_cache_lock = threading.Lock()
+
+def load_forecast(cur) -> list[dict]:
+    cur.execute(f"""
+        SELECT f.container_id, c.node_id, c.zone_id, {", ".join(f"f.{column}" for column in STATE_COLUMNS)}
+        FROM container_forecast f
+        JOIN containers c ON c.id = f.container_id
+        WHERE f.n > 0
+        ORDER BY f.container_id
+    """)
+    forecasts = []
+    for container_id, node_id, zone_id, *state in cur.fetchall():
+        cycle_start, rate, full_at = published(tuple(state))
+        # Only published values: the current level is in /api/containers/latest
+        forecasts.append({
+            "container_id": container_id,
+            "node_id": node_id,
+            "zone_id": zone_id,
+            "cycle_start": cycle_start,
+            "rate_per_hour": rate,
+            "predicted_full_at": full_at,
+        })
+    return forecasts
+
+def forecast_body(conn, version: int) -> bytes:
+    """JSON of every forecast, computed once per data version however many clients ask."""
+    global _cached
+    with _cache_lock:
+        if _cached[0] != version:
+            body = json.dumps(load_forecast(conn.cursor()), default=datetime.isoformat, separators=(",", ":"))
+            _cached = (version, body.encode())
+        return _cached[1]
+
+if __name__ == "__main__":
+    print(f"Rebuilt the forecast of {run_recompute()} containers")
@@ -0,0 +1,31 @@
+"""
+Idempotencia: claves de lotes ya aceptados (tabla ingest_batches)
+
+A batch key is claimed before its readings are published and released again
+if publishing fails, so a retried batch is published exactly once.
+"""
+
+from app.db import get_conn
+from app.settings import INGEST_BATCH_KEY_TTL_HOURS
+
+def claim_batch(key: str, count: int) -> bool:
+    """Record key as accepted. False if it was already claimed (a retry)."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO ingest_batches (key, count) VALUES (%s, %s) ON CONFLICT (key) DO NOTHING",
+                (key, count)
+            )
+            return cur.rowcount == 1
+
+def release_batch(key: str):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM ingest_batches WHERE key = %s", (key,))
+
+def expire_batch_keys(cur, ttl_hours: int = INGEST_BATCH_KEY_TTL_HOURS) -> int:
+    cur.execute(
+        "DELETE FROM ingest_batches WHERE received_at < now() - make_interval(hours => %s)",
+        (ttl_hours,)
+    )
+    return cur.rowcount
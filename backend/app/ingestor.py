@@ -1,15 +1,135 @@
-import os
+import asyncio
 import json
-from fastapi import FastAPI
+import zlib
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from typing import Callable, List, Optional, get_origin
+from fastapi import FastAPI, Request, Response, HTTPException, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
 from pydantic import BaseModel
-import paho.mqtt.publish as publish
-from app.settings import MQTT_BROKER, MQTT_PORT, MQTT_TOPIC
-from app.db import ensure_tables, get_conn
-from psycopg2.extras import RealDictCursor
+from app.settings import (
+    MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, MQTT_PARTITIONS, MQTT_PAYLOAD_FORMAT,
+    MQTT_PUBLISH_MAX_PENDING, MQTT_MAX_INFLIGHT, REPORT_BATCH_MAX,
+    NODE_CACHE_SIZE, NODE_CACHE_TTL, NODE_CACHE_NEGATIVE_TTL, REPORT_BODY_MAX_BYTES, REPORT_PUBLISH_TIMEOUT
+)
+from app.db import get_conn, listen, pool_stats, DatabaseUnavailable
+from app.cache import TTLCache, MISSING
+from app.publisher import MqttPublisher, PublisherBusy, PublishFailed, partition_topic
+from app.idempotency import claim_batch, release_batch
+from app import wire
+from app.metrics import Counter, Gauge, instrument, mark
+from app.migrate import check_schema
 
-ensure_tables()
+publisher = MqttPublisher(MQTT_BROKER, MQTT_PORT, MQTT_PUBLISH_MAX_PENDING, MQTT_MAX_INFLIGHT)
 
-app = FastAPI()
+# node_id -> parsed GeoJSON location, or None for nodes without location
+node_cache = TTLCache(NODE_CACHE_SIZE, NODE_CACHE_TTL, NODE_CACHE_NEGATIVE_TTL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    check_schema()
+    publisher.start()
+    # Payload is the node id; None means we (re)connected and may have missed changes
+    listen("processor_nodes_changed", node_cache.invalidate)
+    yield
+    publisher.stop()
+
+# --- Gzip and binary request bodies (batches from processing nodes) ---
+def gunzip(body: bytes) -> bytes:
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, REPORT_BODY_MAX_BYTES)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="Invalid gzip body")
+    if decompressor.unconsumed_tail:
+        raise HTTPException(status_code=413, detail=f"Body larger than {REPORT_BODY_MAX_BYTES} bytes")
+    return data
+
+class GzipRequest(Request):
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            body = await super().body()
+            if self.headers.get("Content-Encoding", "").lower() == "gzip":
+                body = gunzip(body)
+            self._body = body
+        return self._body
+
+class WireRequest(GzipRequest):
+    """
+    Body in the binary wire format. FastAPI only parses JSON bodies, so the
+    request advertises application/json and json() returns the decoded readings.
+    """
+
+    def __init__(self, request: Request, many: bool):
+        headers = [(k, v) for k, v in request.scope["headers"] if k != b"content-type"]
+        headers.append((b"content-type", b"application/json"))
+        super().__init__({**request.scope, "headers": headers}, request.receive)
+        self.many = many
+
+    async def json(self):
+        if not hasattr(self, "_json"):
+            try:
+                readings = wire.decode_readings(await self.body())
+            except wire.WireError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid binary body: {e}")
+            if not self.many and len(readings) != 1:
+                raise HTTPException(status_code=400, detail="Expected exactly one reading")
+            self._json = readings if self.many else readings[0]
+        return self._json
+
+class GzipRoute(APIRoute):
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+        many = self.body_field is not None and get_origin(self.body_field.field_info.annotation) is list
+
+        async def route_handler(request: Request) -> Response:
+            if wire.is_wire(request.headers.get("Content-Type")):
+                return await original_route_handler(WireRequest(request, many))
+            return await original_route_handler(GzipRequest(request.scope, request.receive))
+
+        return route_handler
+
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = GzipRoute
+instrument(app)
+
+# --- Metrics ---
+readings_total = Counter("sced_ingest_readings_total", "Readings accepted and queued for MQTT")
+Counter("sced_mqtt_published_total", "Messages acknowledged by the broker", collect=lambda: publisher.published)
+Counter("sced_mqtt_publish_rejected_total", "Messages refused because too many were pending",
+        collect=lambda: publisher.rejected)
+Gauge("sced_mqtt_publish_pending", "Messages queued or in flight to the broker",
+      collect=lambda: publisher.stats()["pending"])
+Gauge("sced_mqtt_connected", "1 while the publisher is connected to the broker",
+      collect=lambda: int(publisher.connected))
+
+@app.exception_handler(DatabaseUnavailable)
+def database_unavailable(request: Request, exc: DatabaseUnavailable):
+    return JSONResponse(status_code=503, content={"error": "Database unavailable"})
+
+@app.exception_handler(PublisherBusy)
+def publisher_busy(request: Request, exc: PublisherBusy):
+    return JSONResponse(status_code=503, content={"error": "Ingest queue full, retry later"},
+                        headers={"Retry-After": "1"})
+
+@app.get("/api/stats/db")
+def db_stats():
+    return pool_stats()
+
+@app.get("/api/stats/mqtt")
+def mqtt_stats():
+    return publisher.stats()
+
+@app.get("/api/stats/cache")
+def cache_stats():
+    return {"nodes": node_cache.stats()}
+
+class Trace(BaseModel):
+    """Sampled tracing, see app/metrics.py."""
+    id: str
+    t: List[float]
 
 class ReportPayload(BaseModel):
     node_id: str
@@ -17,38 +137,140 @@ class ReportPayload(BaseModel):
     fill_level: float
     timestamp: str
     created_at: str
+    trace: Optional[Trace] = None
+
+def get_node_locations(node_ids: set[str]) -> dict[str, dict | None]:
+    """Return the location of each node, registering unknown nodes with NULL location."""
+    generation = node_cache.generation
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, ST_AsGeoJSON(location) FROM processor_nodes WHERE id = ANY(%s)",
+                (list(node_ids),)
+            )
+            locations = dict(cur.fetchall())
+            missing = [node_id for node_id in node_ids if node_id not in locations]
+            for node_id in missing:
+                cur.execute(
+                    "INSERT INTO processor_nodes (id, location) VALUES (%s, NULL) ON CONFLICT (id) DO NOTHING",
+                    (node_id,)
+                )
+                locations[node_id] = None
+
+    locations = {
+        node_id: json.loads(location) if location else None
+        for node_id, location in locations.items()
+    }
+    for node_id, location in locations.items():
+        # Skipped if a node changed while we were reading it
+        node_cache.set(node_id, location, generation)
+    return locations
+
+async def resolve_locations(node_ids: set[str]) -> dict[str, dict | None]:
+    locations = {}
+    misses = set()
+    for node_id in node_ids:
+        location = node_cache.get(node_id)
+        if location is MISSING:
+            misses.add(node_id)
+        else:
+            locations[node_id] = location
+    if misses:
+        # psycopg2 is blocking, keep it off the event loop
+        locations.update(await run_in_threadpool(get_node_locations, misses))
+    return locations
+
+MQTT_CONTENT_TYPE = wire.CONTENT_TYPE if MQTT_PAYLOAD_FORMAT == "binary" else None
+
+def encode_message(reading: dict) -> str | bytes:
+    if MQTT_PAYLOAD_FORMAT == "binary":
+        # One reading per message: workers acknowledge messages, not readings
+        return wire.encode_readings([reading])
+    return json.dumps(reading)
+
+async def publish_reports(payloads: List[ReportPayload]) -> Future:
+    """Queue the readings; the returned future resolves once the broker acknowledged them all."""
+    locations = await resolve_locations({p.node_id for p in payloads})
+
+    unlocated = sorted(node_id for node_id, location in locations.items() if location is None)
+    if unlocated:
+        raise HTTPException(status_code=422, detail=f"Node without location: {', '.join(unlocated)}")
+
+    readings = []
+    for p in payloads:
+        reading = {
+            "node_id": p.node_id,
+            "container_id": p.container_id,
+            "fill_level": p.fill_level,
+            "location": locations[p.node_id],
+            "timestamp": p.timestamp,
+            "created_at": p.created_at
+        }
+        if p.trace:
+            reading["trace"] = mark(p.trace.model_dump())
+        readings.append(reading)
+    try:
+        messages = [
+            (partition_topic(MQTT_TOPIC, r["container_id"], MQTT_PARTITIONS), encode_message(r))
+            for r in readings
+        ]
+    except wire.WireError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    # Only queues locally, the publisher's network thread talks to the broker
+    acked = publisher.publish_many(messages, qos=1, content_type=MQTT_CONTENT_TYPE)
+    readings_total.inc(len(messages))
+    return acked
+
+async def wait_for_broker(acked: Future) -> bool:
+    """
+    True once the broker acknowledged every reading, False if it is still
+    pending after REPORT_PUBLISH_TIMEOUT. Raises PublishFailed when a message
+    was refused or could not be queued.
+    """
+    waiter = asyncio.wrap_future(acked)
+    # Retrieves a failure that comes after the timeout, so asyncio does not log it
+    waiter.add_done_callback(lambda f: f.cancelled() or f.exception())
+    # Not cancelled at the timeout: paho keeps the messages and sends them on reconnect
+    done, _ = await asyncio.wait([waiter], timeout=REPORT_PUBLISH_TIMEOUT)
+    if not done:
+        return False
+    waiter.result()
+    return True
 
 # --- API: Receive data from edge node ---
 @app.post("/api/report")
 async def report(payload: ReportPayload):
-    # Ensure node exists or create it with NULL location
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT id, ST_AsGeoJSON(location) AS location FROM processor_nodes WHERE id = %s", (payload.node_id,))
-            node = cur.fetchone()
-            if not node:
-                cur.execute("INSERT INTO processor_nodes (id, location) VALUES (%s, NULL)", (payload.node_id,))
-                conn.commit()
-                node = {"id": payload.node_id, "location": None}
-
-    if "location" not in node or node["location"] is None:
-        raise Exception("ERR location")
-
-    mqtt_payload = {
-        "node_id": payload.node_id,
-        "container_id": payload.container_id,
-        "fill_level": payload.fill_level,
-        "location": json.loads(node["location"]),
-        "timestamp": payload.timestamp,
-        "created_at": payload.created_at
-    }
+    await publish_reports([payload])
+    return {"status": "queued"}
 
-    # Publish the message to MQTT
-    publish.single(
-        MQTT_TOPIC,
-        payload=json.dumps(mqtt_payload),
-        hostname=MQTT_BROKER,
-        port=MQTT_PORT
-    )
+@app.post("/api/report/batch")
+async def report_batch(
+    payloads: List[ReportPayload],
+    idempotency_key: str | None = Header(default=None, max_length=200)
+):
+    if len(payloads) > REPORT_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {REPORT_BATCH_MAX} readings per batch")
+    if not payloads:
+        return {"status": "queued", "count": 0}
 
-    return {"status": "queued"}
\ No newline at end of file
+    # A retry of a batch we already accepted: ack it without publishing again
+    if idempotency_key and not await run_in_threadpool(claim_batch, idempotency_key, len(payloads)):
+        return {"status": "duplicate", "count": len(payloads)}
+    # The claim is only released when publishing failed for good. A batch
+    # still queued in paho keeps it: the messages go out on reconnect, so a
+    # retry must not queue another copy.
+    try:
+        delivered = await wait_for_broker(await publish_reports(payloads))
+    except PublishFailed as e:
+        if idempotency_key:
+            await run_in_threadpool(release_batch, idempotency_key)
+        raise HTTPException(status_code=503, detail=f"Broker did not accept the readings: {e}",
+                            headers={"Retry-After": "1"})
+    except Exception:
+        if idempotency_key:
+            await run_in_threadpool(release_batch, idempotency_key)
+        raise
+    if not delivered:
+        return JSONResponse(status_code=202, content={"status": "pending", "count": len(payloads)})
+    return {"status": "queued", "count": len(payloads)}
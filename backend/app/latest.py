@@ -0,0 +1,84 @@
+"""
+Latest: última lectura conocida de cada contenedor (tabla container_latest)
+"""
+
+import json
+from psycopg2.extras import execute_values
+
+LATEST_VERSION = "container_latest"
+# NOTIFY channel carrying the changed rows, see app/live.py
+LATEST_CHANNEL = "container_latest_changed"
+NOTIFY_PAYLOAD_MAX = 7000  # PostgreSQL rejects payloads of 8000 bytes or more
+LATEST_COLUMNS = ("container_id", "node_id", "zone_id", "fill_level", "timestamp", "received_at", "lon", "lat")
+
+def update_latest(cur, readings: list[dict], received_at) -> int:
+    """
+    Upsert the newest reading of each container. Rows are only replaced by
+    newer timestamps, so out-of-order batches are safe. Changed rows are
+    announced on LATEST_CHANNEL when the transaction commits. Returns the
+    number of containers whose latest reading changed.
+    """
+    newest = {}
+    for r in readings:
+        current = newest.get(r["container_id"])
+        if current is None or r["timestamp"] > current["timestamp"]:
+            newest[r["container_id"]] = r
+    if not newest:
+        return 0
+
+    rows = [
+        (container_id, r["fill_level"], r["timestamp"], received_at)
+        for container_id, r in sorted(newest.items())
+    ]
+    returned = execute_values(cur, """
+        INSERT INTO container_latest AS l (
+            container_id, node_id, zone_id, fill_level, timestamp, received_at, lon, lat
+        )
+        SELECT v.container_id, c.node_id, c.zone_id, v.fill_level, v.timestamp, v.received_at,
+               ST_X(c.location::geometry), ST_Y(c.location::geometry)
+        FROM (VALUES %s) AS v (container_id, fill_level, timestamp, received_at)
+        JOIN containers c ON c.id = v.container_id
+        ON CONFLICT (container_id) DO UPDATE SET
+            node_id = EXCLUDED.node_id,
+            zone_id = EXCLUDED.zone_id,
+            fill_level = EXCLUDED.fill_level,
+            timestamp = EXCLUDED.timestamp,
+            received_at = EXCLUDED.received_at,
+            lon = EXCLUDED.lon,
+            lat = EXCLUDED.lat
+        WHERE l.timestamp < EXCLUDED.timestamp
+        RETURNING l.container_id, l.node_id, l.zone_id, l.fill_level, l.timestamp, l.received_at, l.lon, l.lat
+    """, rows, template="(%s, %s::float8, %s::timestamp, %s::timestamp)", page_size=len(rows), fetch=True)
+    changed = [
+        dict(zip(LATEST_COLUMNS, row[:4] + (row[4].isoformat(), row[5].isoformat()) + row[6:]))
+        for row in returned
+    ]
+    if changed:
+        notify_latest(cur, changed)
+        bump_version(cur, LATEST_VERSION)
+    return len(changed)
+
+def notify_latest(cur, rows: list[dict]):
+    # Split into payloads under the NOTIFY limit, sent with a single statement
+    payloads = []
+    chunk = []
+    size = 0
+    for row in rows:
+        encoded = json.dumps(row, separators=(",", ":"))
+        if chunk and size + len(encoded) + 1 > NOTIFY_PAYLOAD_MAX:
+            payloads.append("[" + ",".join(chunk) + "]")
+            chunk, size = [], 0
+        chunk.append(encoded)
+        size += len(encoded) + 1
+    payloads.append("[" + ",".join(chunk) + "]")
+    cur.execute("SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload", (LATEST_CHANNEL, payloads))
+
+def bump_version(cur, name: str):
+    # Row lock held until commit, so versions follow commit order.
+    # Call it last in the transaction to keep that lock short.
+    cur.execute("UPDATE data_versions SET version = version + 1 WHERE name = %s", (name,))
+
+def get_version(cur, name: str) -> int:
+    cur.execute("SELECT version FROM data_versions WHERE name = %s", (name,))
+    row = cur.fetchone()
+    return row[0] if row else 0
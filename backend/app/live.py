@@ -0,0 +1,102 @@
+"""
+Live: actualizaciones de container_latest enviadas al dashboard por SSE
+
+The worker announces every changed container_latest row through NOTIFY
+(app/latest.py). Each API process holds a single LISTEN connection and fans
+the rows out to its subscribers, so database load does not grow with the
+number of open dashboards. Rows are coalesced per container and flushed at
+most every LIVE_COALESCE_MS, so a burst costs one event per client.
+"""
+
+import asyncio
+import json
+from app.db import listen
+from app.latest import LATEST_CHANNEL
+from app.metrics import Counter, Gauge
+from app.settings import LIVE_COALESCE_MS, LIVE_HEARTBEAT_SECONDS
+
+class Subscriber:
+    def __init__(self, zones: set[str] | None):
+        self.zones = zones
+        # container_id -> newest row not yet sent; bounded by the number of containers
+        self.pending = {}
+        self.resync = False
+        self.event = asyncio.Event()
+
+    def offer(self, rows: list[dict]):
+        for row in rows:
+            if self.zones is not None and row.get("zone_id") not in self.zones:
+                continue
+            current = self.pending.get(row["container_id"])
+            if current is None or row["timestamp"] >= current["timestamp"]:
+                self.pending[row["container_id"]] = row
+        if self.pending:
+            self.event.set()
+
+    def request_resync(self):
+        self.resync = True
+        self.pending.clear()
+        self.event.set()
+
+class LiveHub:
+    def __init__(self):
+        self.subscribers: set[Subscriber] = set()
+        self.loop = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        listen(LATEST_CHANNEL, self._notified)
+
+    def _notified(self, payload: str | None):
+        # Runs in the listener thread; subscribers are only touched on the event loop
+        if payload is None:
+            # (Re)connected: changes may have been missed, clients reload their snapshot
+            self.loop.call_soon_threadsafe(self._broadcast_resync)
+            return
+        try:
+            rows = json.loads(payload)
+        except ValueError:
+            return
+        self.loop.call_soon_threadsafe(self._broadcast, rows)
+
+    def _broadcast(self, rows: list[dict]):
+        notified_rows.inc(len(rows))
+        for subscriber in self.subscribers:
+            subscriber.offer(rows)
+
+    def _broadcast_resync(self):
+        for subscriber in self.subscribers:
+            subscriber.request_resync()
+
+    async def stream(self, zones: set[str] | None):
+        """Server-sent events: `update` with a list of rows, `resync` when the client must refetch."""
+        subscriber = Subscriber(zones)
+        self.subscribers.add(subscriber)
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    await asyncio.wait_for(subscriber.event.wait(), LIVE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle stream
+                    yield ": ping\n\n"
+                    continue
+                # Let a burst of notifications accumulate before sending
+                await asyncio.sleep(LIVE_COALESCE_MS / 1000)
+                subscriber.event.clear()
+                if subscriber.resync:
+                    subscriber.resync = False
+                    yield "event: resync\ndata: {}\n\n"
+                if subscriber.pending:
+                    rows = list(subscriber.pending.values())
+                    subscriber.pending.clear()
+                    sent_events.inc()
+                    yield f"event: update\ndata: {json.dumps(rows, separators=(',', ':'))}\n\n"
+        finally:
+            self.subscribers.discard(subscriber)
+
+hub = LiveHub()
+
+notified_rows = Counter("sced_live_notified_rows_total", "container_latest rows received through NOTIFY")
+sent_events = Counter("sced_live_events_total", "Update events sent to live subscribers")
+Gauge("sced_live_subscribers", "Open /api/live streams", collect=lambda: len(hub.subscribers))
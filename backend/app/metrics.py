@@ -0,0 +1,236 @@
+"""
+Metrics: contadores, gauges e histogramas en formato de texto de Prometheus
+
+Metrics live in a process-wide registry and are rendered by render(). FastAPI
+services mount them with instrument(app), which also records a latency
+histogram per route; processes without HTTP server call serve(port).
+
+Sampled tracing follows one reading across the pipeline: start_trace() gives
+it a trace {"id", "t"} to which every stage adds its wall-clock time with
+mark(); finish_trace() observes the time spent between stages. Stages run on
+different hosts, so clocks must be kept in sync (NTP) for these to be
+meaningful. The same file lives in processing-node/metrics.py; keep both
+copies identical (tests/system_test.py checks it).
+"""
+
+import math
+import random
+from bisect import bisect_left
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """
+    Updated explicitly, or read at scrape time from `collect`, returning a
+    value or {label values: value}; handy for state services already keep.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), collect=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _check(self, label_values: tuple):
+        if len(label_values) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {label_values}")
+
+    def samples(self):
+        if self.collect is not None:
+            try:
+                value = self.collect()
+            except Exception:
+                # A failing collector must not break the whole scrape
+                return []
+            values = value if isinstance(value, dict) else {(): value}
+            return [(self.name, labels, "", v) for labels, v in values.items()]
+        with self._lock:
+            return [(self.name, labels, "", value) for labels, value in self._values.items()]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, extra, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.label_names, labels, extra)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, *labels):
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, *labels):
+        self._check(labels)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items()]
+        samples = []
+        for labels, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                samples.append((f"{self.name}_bucket", labels, f'le="{_format_value(bound)}"', cumulative))
+            samples.append((f"{self.name}_sum", labels, "", total))
+            samples.append((f"{self.name}_count", labels, "", count))
+        return samples
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- Exposition ---
+http_latency = Histogram(
+    "sced_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+
+class LatencyMiddleware:
+    """Plain ASGI middleware: cheaper than BaseHTTPMiddleware and it also times streamed bodies."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # The router stores the matched route in the scope; templates keep cardinality bounded
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            http_latency.observe(time.perf_counter() - started, scope["method"], path, status)
+
+def instrument(app):
+    """Time every request by route template and serve GET /metrics."""
+    from fastapi import Response
+
+    app.add_middleware(LatencyMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return Response(render(), media_type=CONTENT_TYPE)
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port: int) -> ThreadingHTTPServer:
+    """Serve /metrics from a daemon thread, for processes that are not web apps."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+# --- Sampled tracing ---
+# Order in which a reading passes through the pipeline; trace["t"][i] is the time of stage i
+TRACE_STAGES = ("push", "aggregate", "uplink", "ingest", "insert")
+
+trace_stage_seconds = Histogram(
+    "sced_trace_stage_seconds", "Time a traced reading spent reaching each stage from the previous one",
+    ("stage",), buckets=LAG_BUCKETS
+)
+trace_end_to_end_seconds = Histogram(
+    "sced_trace_end_to_end_seconds", "Time from /push to the container_readings insert of traced readings",
+    buckets=LAG_BUCKETS
+)
+
+def sampled(rate: float) -> bool:
+    return rate > 0 and random.random() < rate
+
+def start_trace() -> dict:
+    return {"id": uuid.uuid4().hex[:16], "t": [time.time()]}
+
+def mark(trace: dict | None) -> dict | None:
+    """Copy of the trace recording that the reading reached the next stage."""
+    if trace is None:
+        return None
+    return {"id": trace["id"], "t": [*trace["t"], time.time()]}
+
+def finish_trace(trace: dict) -> dict:
+    """Observe the stage timings of a completed trace and return them by stage name."""
+    times = trace["t"]
+    stages = {}
+    for stage, previous, current in zip(TRACE_STAGES[1:], times, times[1:]):
+        stages[stage] = current - previous
+        trace_stage_seconds.observe(current - previous, stage)
+    if len(times) > 1:
+        trace_end_to_end_seconds.observe(times[-1] - times[0])
+    return stages
@@ -0,0 +1,154 @@
+"""
+Migrate: migraciones versionadas del esquema (backend/migrations)
+
+Migrations are SQL files named NNNN_description.sql, applied in order by
+`python -m app.migrate` and recorded in schema_migrations. Services never run
+them: on startup they only compare the newest recorded version with the
+newest file (check_schema), a single indexed query.
+
+Each migration runs in its own transaction under an advisory lock, so several
+migrate runs can start at once. A file whose first line is
+`-- migrate: no-transaction` runs statement by statement in autocommit
+instead, for statements like CREATE INDEX CONCURRENTLY that cannot run in a
+transaction; write those so a failed run can simply be repeated (IF NOT
+EXISTS) and end every statement with `;` at the end of a line.
+"""
+
+import hashlib
+import os
+import re
+import sys
+from app.db import get_conn
+from app.partitions import maintain
+from app.settings import DB_CONNECT_RETRIES, MIGRATE_ON_START
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+FILENAME_RE = re.compile(r"^(\d+)_\w+\.sql$")
+NO_TRANSACTION = "-- migrate: no-transaction"
+# Serializes migrate runs; app.partitions uses 5_410_001
+ADVISORY_LOCK_ID = 5_410_002
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        checksum TEXT NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+"""
+
+class SchemaOutdated(RuntimeError):
+    """The database lacks migrations this code depends on."""
+
+def list_migrations(directory: str = MIGRATIONS_DIR) -> list[tuple[int, str, str]]:
+    """(version, file name, path) of every migration, oldest first."""
+    migrations = []
+    for name in os.listdir(directory):
+        match = FILENAME_RE.match(name)
+        if match:
+            migrations.append((int(match[1]), name, os.path.join(directory, name)))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+def latest_version() -> int:
+    migrations = list_migrations()
+    return migrations[-1][0] if migrations else 0
+
+def current_version(cur) -> int | None:
+    """Newest applied migration, or None when the database was never migrated."""
+    cur.execute("SELECT to_regclass('schema_migrations')")
+    if cur.fetchone()[0] is None:
+        return None
+    cur.execute("SELECT max(version) FROM schema_migrations")
+    return cur.fetchone()[0]
+
+def _statements(text: str) -> list[str]:
+    statements = []
+    for statement in re.split(r";[ \t]*(?:\n|$)", text):
+        code = "\n".join(line for line in statement.splitlines() if not line.lstrip().startswith("--"))
+        if code.strip():
+            statements.append(statement)
+    return statements
+
+def _pending(cur, version: int, name: str, checksum: str) -> bool:
+    cur.execute("SELECT checksum FROM schema_migrations WHERE version = %s", (version,))
+    row = cur.fetchone()
+    if row is not None and row[0] != checksum:
+        print(f"Warning: {name} was modified after being applied; create a new migration instead")
+    return row is None
+
+def migrate() -> list[str]:
+    """Apply every pending migration and return the names of those applied."""
+    applied = []
+    with get_conn(retries=DB_CONNECT_RETRIES) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (ADVISORY_LOCK_ID,))
+        cur.execute(CREATE_TABLE)
+        conn.commit()
+
+        for version, name, path in list_migrations():
+            with open(path) as f:
+                text = f.read()
+            checksum = hashlib.sha256(text.encode()).hexdigest()
+            record = ("INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+                      (version, name, checksum))
+
+            if text.startswith(NO_TRANSACTION):
+                conn.autocommit = True
+                cur.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_ID,))
+                try:
+                    if _pending(cur, version, name, checksum):
+                        for statement in _statements(text):
+                            cur.execute(statement)
+                        cur.execute(*record)
+                        applied.append(name)
+                        print(f"Applied migration {name}")
+                finally:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_ID,))
+                    conn.autocommit = False
+            else:
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (ADVISORY_LOCK_ID,))
+                if _pending(cur, version, name, checksum):
+                    cur.execute(text)
+                    cur.execute(*record)
+                    applied.append(name)
+                    print(f"Applied migration {name}")
+                conn.commit()
+
+        # Readings can only be inserted once a partition covers their timestamp
+        maintain(cur)
+    return applied
+
+def check_schema():
+    """
+    Called by every service on startup. Raises SchemaOutdated when migrations
+    shipped with this code are missing, unless MIGRATE_ON_START is set. A
+    newer schema is accepted, so old replicas keep running during a rollout.
+    """
+    required = latest_version()
+    with get_conn(retries=DB_CONNECT_RETRIES) as conn:
+        current = current_version(conn.cursor())
+    if current is not None and current >= required:
+        return
+    if MIGRATE_ON_START:
+        migrate()
+        return
+    raise SchemaOutdated(
+        f"Database schema is at version {current or 0}, this code needs {required}; "
+        "run `python -m app.migrate` first"
+    )
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--check"]:
+        try:
+            check_schema()
+        except SchemaOutdated as e:
+            print(e)
+            sys.exit(1)
+        print("Database schema is up to date")
+    else:
+        applied = migrate()
+        print(f"Applied {len(applied)} migration(s); schema at version {latest_version()}")
@@ -0,0 +1,168 @@
+"""
+Particiones: mantenimiento de las particiones por tiempo de container_readings
+
+Run once with `python -m app.partitions` (e.g. from cron); the worker also
+runs it periodically. Readings outside every partition land in the default
+partition; when a partition is later created for their range, they are moved
+into it, since Postgres refuses to create a partition the default one has
+rows for.
+"""
+
+import re
+from datetime import date, datetime, timedelta
+from psycopg2 import sql
+from app.db import get_conn
+from app.settings import (
+    READINGS_PARTITION_INTERVAL, READINGS_PARTITIONS_AHEAD, READINGS_RETENTION_DAYS
+)
+
+PARENT = "container_readings"
+LEGACY = "container_readings_legacy"
+DEFAULT = "container_readings_default"
+# Serializes maintenance between processes (worker replicas, cron)
+ADVISORY_LOCK_ID = 5_410_001
+
+BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+def period_start(day: date) -> date:
+    if READINGS_PARTITION_INTERVAL == "month":
+        return day.replace(day=1)
+    return day
+
+def next_period(start: date) -> date:
+    if READINGS_PARTITION_INTERVAL == "month":
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+def list_partitions(cur) -> list[tuple[str, datetime, datetime]]:
+    """(name, lower bound, upper bound) of every range partition, the default one excluded."""
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, (PARENT,))
+    partitions = []
+    for name, bound in cur.fetchall():
+        match = BOUND_RE.search(bound or "")
+        if match:
+            partitions.append((name, datetime.fromisoformat(match[1]), datetime.fromisoformat(match[2])))
+    return sorted(partitions, key=lambda p: p[1])
+
+def create_partitions(cur, first_day: date, last_day: date) -> list[str]:
+    """Create the partitions covering [first_day, last_day], skipping ranges already covered."""
+    existing = [(lower, upper) for _, lower, upper in list_partitions(cur)]
+    created = []
+    start = period_start(first_day)
+    while start <= last_day:
+        end = next_period(start)
+        lower = datetime.combine(start, datetime.min.time())
+        upper = datetime.combine(end, datetime.min.time())
+        if not any(lower < e_upper and e_lower < upper for e_lower, e_upper in existing):
+            name = f"{PARENT}_p{start:%Y%m%d}"
+            moved = _take_from_default(cur, lower, upper)
+            cur.execute(
+                sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)").format(
+                    sql.Identifier(name), sql.Identifier(PARENT)
+                ),
+                (lower, upper)
+            )
+            if moved:
+                cur.execute(sql.SQL("INSERT INTO {} SELECT * FROM partition_staging").format(sql.Identifier(name)))
+                cur.execute("TRUNCATE partition_staging")
+                print(f"Moved {moved} readings from {DEFAULT} into {name}")
+            created.append(name)
+        start = end
+    return created
+
+def _take_from_default(cur, lower: datetime, upper: datetime) -> int:
+    """Move the default partition's rows in [lower, upper) into the partition_staging temp table."""
+    cur.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM {} WHERE timestamp >= %s AND timestamp < %s)").format(
+        sql.Identifier(DEFAULT)
+    ), (lower, upper))
+    if not cur.fetchone()[0]:
+        return 0
+    # Keeps writers from adding rows for this range before the partition exists
+    cur.execute(sql.SQL("LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE").format(sql.Identifier(DEFAULT)))
+    cur.execute(sql.SQL("CREATE TEMP TABLE IF NOT EXISTS partition_staging (LIKE {}) ON COMMIT DROP").format(
+        sql.Identifier(PARENT)
+    ))
+    cur.execute(sql.SQL("""
+        WITH moved AS (DELETE FROM {} WHERE timestamp >= %s AND timestamp < %s RETURNING *)
+        INSERT INTO partition_staging SELECT * FROM moved
+    """).format(sql.Identifier(DEFAULT)), (lower, upper))
+    return cur.rowcount
+
+def drop_expired_partitions(cur, retention_days: int, today: date | None = None) -> list[str]:
+    """Drop whole partitions whose rows are all older than the retention window."""
+    if retention_days <= 0:
+        return []
+    cutoff = datetime.combine((today or date.today()) - timedelta(days=retention_days), datetime.min.time())
+    dropped = []
+    for name, _, upper in list_partitions(cur):
+        if upper <= cutoff:
+            cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+            dropped.append(name)
+    return dropped
+
+def migrate_legacy_table(cur, today: date) -> int:
+    """
+    Move rows from the pre-partitioning table (renamed by migrations/0001_initial.sql)
+    into partitions. Partitions are only created for periods that have rows,
+    between the retention cutoff and the partitions created ahead; readings
+    outside that range (bad clocks) stay in the default partition.
+    """
+    cur.execute("SELECT to_regclass(%s)", (LEGACY,))
+    if cur.fetchone()[0] is None:
+        return 0
+
+    first_day = today - timedelta(days=READINGS_RETENTION_DAYS) if READINGS_RETENTION_DAYS > 0 else date.min
+    last_day = today + timedelta(days=READINGS_PARTITIONS_AHEAD)
+    cur.execute(sql.SQL("""
+        SELECT DISTINCT date_trunc(%s, timestamp)::date FROM {}
+        WHERE timestamp >= %s AND timestamp < %s
+        ORDER BY 1
+    """).format(sql.Identifier(LEGACY)), (
+        READINGS_PARTITION_INTERVAL, period_start(first_day), next_period(period_start(last_day))
+    ))
+    periods = [day for day, in cur.fetchall()]
+    for day in periods:
+        create_partitions(cur, day, day)
+
+    cur.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM {})").format(sql.Identifier(LEGACY)))
+    moved = 0
+    if cur.fetchone()[0]:
+        cur.execute(sql.SQL("""
+            INSERT INTO {} (id, container_id, fill_level, timestamp, received_at)
+            SELECT id, container_id, fill_level, timestamp, received_at FROM {}
+        """).format(sql.Identifier(PARENT), sql.Identifier(LEGACY)))
+        moved = cur.rowcount
+        cur.execute(
+            sql.SQL("SELECT setval(pg_get_serial_sequence(%s, 'id'), (SELECT max(id) FROM {}))").format(
+                sql.Identifier(PARENT)
+            ),
+            (PARENT,)
+        )
+    cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(LEGACY)))
+    return moved
+
+def maintain(cur, today: date | None = None) -> dict:
+    """Create upcoming partitions and drop expired ones. Runs inside the caller's transaction."""
+    today = today or date.today()
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (ADVISORY_LOCK_ID,))
+    moved = migrate_legacy_table(cur, today)
+    created = create_partitions(cur, today, today + timedelta(days=READINGS_PARTITIONS_AHEAD))
+    dropped = drop_expired_partitions(cur, READINGS_RETENTION_DAYS, today)
+    if moved:
+        print(f"Moved {moved} readings from {LEGACY} into partitions")
+    if created or dropped:
+        print(f"Partitions created: {created}, dropped: {dropped}")
+    return {"created": created, "dropped": dropped, "migrated_rows": moved}
+
+def run_maintenance() -> dict:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            return maintain(cur)
+
+if __name__ == "__main__":
+    run_maintenance()
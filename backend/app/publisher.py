@@ -0,0 +1,135 @@
+"""
+Publisher: conexión MQTT persistente compartida por el ingestor
+"""
+
+import threading
+import zlib
+from concurrent.futures import Future
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+def partition_topic(base: str, key: str, partitions: int) -> str:
+    """Stable topic per key, so one container's readings always travel in order on the same topic."""
+    return f"{base}/{zlib.crc32(key.encode()) % partitions}"
+
+class PublisherBusy(Exception):
+    """Too many messages are waiting to be acknowledged by the broker."""
+
+class PublishFailed(Exception):
+    """The broker refused a message, or paho could not queue it."""
+
+class _Pending:
+    """Messages of one publish_many() call still waiting for their PUBACK."""
+
+    def __init__(self, count: int):
+        self.remaining = count
+        self.future = Future()
+
+class MqttPublisher:
+    """
+    One long-lived paho client running its own network thread. publish_many()
+    only queues messages locally, so it never blocks on the broker; it returns
+    a Future resolved once the broker acknowledged every message. Callers get
+    PublisherBusy once max_pending messages are still unacknowledged.
+    """
+
+    def __init__(self, host: str, port: int, max_pending: int, max_inflight: int):
+        self.host = host
+        self.port = port
+        self.max_pending = max_pending
+        # v5 so messages can carry their ContentType
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv5)
+        self.client.max_inflight_messages_set(max_inflight)
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self.client.on_publish = self._on_publish
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self._lock = threading.Lock()
+        self._pending = 0
+        # mid -> _Pending; acks that arrive before publish() returned the mid are parked in _acked
+        self._waiting = {}
+        self._acked = {}
+        self.connected = False
+        self.published = 0
+        self.rejected = 0
+
+    def start(self):
+        # connect_async lets the network thread retry until the broker is up
+        self.client.connect_async(self.host, self.port, 60)
+        self.client.loop_start()
+
+    def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def publish_many(self, messages: list[tuple[str, str | bytes]], qos: int = 1,
+                     content_type: str | None = None) -> Future:
+        """Queue (topic, payload) messages; the Future fails with PublishFailed if any is refused."""
+        properties = None
+        if content_type:
+            properties = Properties(PacketTypes.PUBLISH)
+            properties.ContentType = content_type
+        with self._lock:
+            if self._pending + len(messages) > self.max_pending:
+                self.rejected += len(messages)
+                raise PublisherBusy(f"{self._pending} messages pending")
+            self._pending += len(messages)
+        pending = _Pending(len(messages))
+        if not messages:
+            pending.future.set_result(None)
+        # QoS 1 messages are kept by paho and resent after a reconnect
+        for topic, payload in messages:
+            info = self.client.publish(topic, payload=payload, qos=qos, properties=properties)
+            if info.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+                # Never sent, so no callback will come for it
+                self._acknowledged(pending, f"Publish failed: {mqtt.error_string(info.rc)}")
+                continue
+            # Not under the lock while publishing: paho calls _on_publish holding its own mutex
+            with self._lock:
+                acked_early = info.mid in self._acked
+                failure = self._acked.pop(info.mid, None)
+                if not acked_early:
+                    self._waiting[info.mid] = pending
+            if acked_early:
+                self._acknowledged(pending, failure)
+        return pending.future
+
+    def _on_publish(self, client, userdata, mid, reason_code, properties):
+        failure = f"Broker refused message: {reason_code}" if reason_code.is_failure else None
+        with self._lock:
+            pending = self._waiting.pop(mid, None)
+            if pending is None:
+                self._acked[mid] = failure
+                return
+        self._acknowledged(pending, failure)
+
+    def _acknowledged(self, pending: _Pending, failure: str | None):
+        with self._lock:
+            self._pending -= 1
+            if failure is None:
+                self.published += 1
+            pending.remaining -= 1
+            done = pending.remaining == 0
+        if failure is not None and not pending.future.done():
+            pending.future.set_exception(PublishFailed(failure))
+        elif done and not pending.future.done():
+            pending.future.set_result(None)
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        self.connected = not reason_code.is_failure
+        print(f"MQTT publisher connected: {reason_code}")
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        self.connected = False
+        print(f"MQTT publisher disconnected: {reason_code}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "connected": self.connected,
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "published": self.published,
+                "rejected": self.rejected,
+            }
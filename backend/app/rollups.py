@@ -0,0 +1,126 @@
+"""
+Rollups: agregados incrementales de nivel de llenado por contenedor (1m/1h/1d)
+
+The worker folds every batch into container_rollups as it is inserted, so
+late readings simply update their (older) bucket. To rebuild a range from
+raw readings (e.g. after a backfill) run:
+
+    python -m app.rollups 2025-01-01 2025-02-01
+
+The rebuild locks container_rollups against the workers, one day at a time
+so ingestion only stalls briefly.
+"""
+
+import sys
+from datetime import datetime, timedelta
+from psycopg2.extras import execute_values
+from app.db import get_conn
+
+# Ordered from finest to coarsest
+BUCKETS = {
+    "1m": timedelta(minutes=1),
+    "1h": timedelta(hours=1),
+    "1d": timedelta(days=1),
+}
+DATE_TRUNC = {"1m": "minute", "1h": "hour", "1d": "day"}
+
+def bucket_start(ts: datetime, bucket: str) -> datetime:
+    if bucket == "1m":
+        return ts.replace(second=0, microsecond=0)
+    if bucket == "1h":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def pick_bucket(start: datetime, end: datetime, max_points: int) -> str:
+    """Finest bucket that still keeps a series under max_points, else the coarsest one."""
+    span = end - start
+    for bucket, width in BUCKETS.items():
+        if span / width <= max_points:
+            return bucket
+    return "1d"
+
+def aggregate(readings: list[dict]) -> list[tuple]:
+    """Fold readings into one row per (bucket, container, bucket_start)."""
+    acc = {}
+    for r in readings:
+        ts = r["timestamp"]
+        level = r["fill_level"]
+        for bucket in BUCKETS:
+            key = (bucket, r["container_id"], bucket_start(ts, bucket))
+            row = acc.get(key)
+            if row is None:
+                acc[key] = [level, level, level, 1, level, ts]
+                continue
+            row[0] = min(row[0], level)
+            row[1] = max(row[1], level)
+            row[2] += level
+            row[3] += 1
+            if ts >= row[5]:
+                row[4] = level
+                row[5] = ts
+    # Sorted so concurrent workers lock rows in the same order
+    return [key + tuple(values) for key, values in sorted(acc.items())]
+
+def update_rollups(cur, readings: list[dict]):
+    """Merge readings (with datetime timestamps) into container_rollups."""
+    rows = aggregate(readings)
+    if not rows:
+        return
+    execute_values(cur, """
+        INSERT INTO container_rollups AS r (
+            bucket, container_id, bucket_start,
+            min_level, max_level, sum_level, count, last_level, last_timestamp
+        )
+        VALUES %s
+        ON CONFLICT (bucket, container_id, bucket_start) DO UPDATE SET
+            min_level = LEAST(r.min_level, EXCLUDED.min_level),
+            max_level = GREATEST(r.max_level, EXCLUDED.max_level),
+            sum_level = r.sum_level + EXCLUDED.sum_level,
+            count = r.count + EXCLUDED.count,
+            last_level = CASE WHEN EXCLUDED.last_timestamp >= r.last_timestamp
+                              THEN EXCLUDED.last_level ELSE r.last_level END,
+            last_timestamp = GREATEST(r.last_timestamp, EXCLUDED.last_timestamp)
+    """, rows, page_size=len(rows))
+
+def rebuild_rollups(cur, start: datetime, end: datetime):
+    """
+    Recompute every bucket overlapping [start, end) from container_readings.
+    Holds a lock on container_rollups until the caller commits.
+    """
+    # Blocks update_rollups: workers that already merged a batch have
+    # committed its readings, so they are counted here, and later ones only
+    # add their batch on top of the rebuilt rows once we commit
+    cur.execute("LOCK TABLE container_rollups IN SHARE ROW EXCLUSIVE MODE")
+    for bucket, unit in DATE_TRUNC.items():
+        first = bucket_start(start, bucket)
+        last = bucket_start(end, bucket)
+        if last < end:
+            last += BUCKETS[bucket]
+        cur.execute(
+            "DELETE FROM container_rollups WHERE bucket = %s AND bucket_start >= %s AND bucket_start < %s",
+            (bucket, first, last)
+        )
+        cur.execute("""
+            INSERT INTO container_rollups (
+                bucket, container_id, bucket_start,
+                min_level, max_level, sum_level, count, last_level, last_timestamp
+            )
+            SELECT %s, container_id, date_trunc(%s, timestamp),
+                   min(fill_level), max(fill_level), sum(fill_level), count(*),
+                   (array_agg(fill_level ORDER BY timestamp DESC))[1], max(timestamp)
+            FROM container_readings
+            WHERE timestamp >= %s AND timestamp < %s
+            GROUP BY container_id, date_trunc(%s, timestamp)
+        """, (bucket, unit, first, last, unit))
+
+if __name__ == "__main__":
+    range_start, range_end = (datetime.fromisoformat(arg) for arg in sys.argv[1:3])
+    day = range_start
+    while day < range_end:
+        # One transaction per day keeps the lock short
+        day_end = min(bucket_start(day, "1d") + BUCKETS["1d"], range_end)
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                rebuild_rollups(cur, day, day_end)
+        day = day_end
+    print(f"Rollups rebuilt from {range_start} to {range_end}")
@@ -1,9 +1,26 @@
 import os
+import socket
 
 # --- MQTT Config ---
 MQTT_BROKER = os.getenv("MQTT_BROKER", "mqtt")
 MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
-MQTT_TOPIC = "sced/report"
+MQTT_TOPIC = "sced/report"  # readings go to sced/report/<partition>
+MQTT_PARTITIONS = int(os.getenv("MQTT_PARTITIONS", "16"))  # partition = hash(container_id) % MQTT_PARTITIONS
+MQTT_SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP", "workers")
+MQTT_CLIENT_ID = os.getenv("MQTT_CLIENT_ID", f"sced-worker-{socket.gethostname()}")  # must be stable across restarts
+MQTT_SESSION_EXPIRY = int(os.getenv("MQTT_SESSION_EXPIRY", "3600"))  # seconds the broker keeps messages for an offline worker
+MQTT_PUBLISH_MAX_PENDING = int(os.getenv("MQTT_PUBLISH_MAX_PENDING", "10000"))  # unacked messages before 503
+MQTT_MAX_INFLIGHT = int(os.getenv("MQTT_MAX_INFLIGHT", "100"))
+MQTT_PAYLOAD_FORMAT = os.getenv("MQTT_PAYLOAD_FORMAT", "json")  # "json" or "binary" (app/wire.py); workers read both
+
+# --- Ingestor Config ---
+REPORT_BATCH_MAX = int(os.getenv("REPORT_BATCH_MAX", "5000"))
+NODE_CACHE_SIZE = int(os.getenv("NODE_CACHE_SIZE", "10000"))
+NODE_CACHE_TTL = float(os.getenv("NODE_CACHE_TTL", "3600"))  # seconds
+NODE_CACHE_NEGATIVE_TTL = float(os.getenv("NODE_CACHE_NEGATIVE_TTL", "30"))  # nodes without location
+REPORT_BODY_MAX_BYTES = int(os.getenv("REPORT_BODY_MAX_BYTES", str(16 * 1024 * 1024)))  # after gunzip
+INGEST_BATCH_KEY_TTL_HOURS = int(os.getenv("INGEST_BATCH_KEY_TTL_HOURS", "72"))  # how long retries are deduplicated
+REPORT_PUBLISH_TIMEOUT = float(os.getenv("REPORT_PUBLISH_TIMEOUT", "10"))  # broker ack wait before a batch is answered 202 pending
 
 # --- PostgreSQL Config ---
 DB_HOST = os.getenv("POSTGRES_HOST", "db")
@@ -11,3 +28,53 @@ DB_NAME = os.getenv("POSTGRES_DB", "sced")
 DB_USER = os.getenv("POSTGRES_USER", "sced_user")
 DB_PASS = os.getenv("POSTGRES_PASSWORD", "securepass")
 DB_PORT = os.getenv("POSTGRES_PORT", "5432")
+
+# --- Connection Pool Config ---
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))  # seconds to wait for a free connection
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))  # close extra idle connections after this
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))  # ping connections idle longer than this
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+DB_CONNECT_RETRIES = int(os.getenv("DB_CONNECT_RETRIES", "10"))  # used at startup only
+
+# --- Schema Migrations ---
+# Services only check the schema version on startup; "1" makes them apply
+# pending migrations themselves (single-process setups without the migrate step)
+MIGRATE_ON_START = os.getenv("MIGRATE_ON_START", "0") == "1"
+
+# --- Worker Config ---
+# "batch" buffers messages and writes them in bulk, "single" writes one message per transaction
+WORKER_MODE = os.getenv("WORKER_MODE", "batch")
+WORKER_BATCH_SIZE = int(os.getenv("WORKER_BATCH_SIZE", "500"))
+WORKER_FLUSH_INTERVAL_MS = int(os.getenv("WORKER_FLUSH_INTERVAL_MS", "200"))
+WORKER_STATS_INTERVAL = int(os.getenv("WORKER_STATS_INTERVAL", "60"))
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))  # 0 = one per CPU
+# "shared": $share subscription, any number of workers on any host split the load
+# "partitioned": worker i of WORKER_PROCESSES owns partitions p % WORKER_PROCESSES == i (per-container order)
+WORKER_SUBSCRIPTION = os.getenv("WORKER_SUBSCRIPTION", "shared")
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))  # worker i serves /metrics on port + i, 0 = off
+
+# --- Observability ---
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0"))  # fraction of per-message log lines printed
+
+# --- Readings Storage Config ---
+READINGS_PARTITION_INTERVAL = os.getenv("READINGS_PARTITION_INTERVAL", "day")  # "day" or "month"
+READINGS_PARTITIONS_AHEAD = int(os.getenv("READINGS_PARTITIONS_AHEAD", "7"))  # days created in advance
+READINGS_RETENTION_DAYS = int(os.getenv("READINGS_RETENTION_DAYS", "0"))  # 0 keeps readings forever
+READINGS_MAINTENANCE_INTERVAL = int(os.getenv("READINGS_MAINTENANCE_INTERVAL", "3600"))  # seconds
+
+# --- Forecast Config ---
+FORECAST_FULL_LEVEL = float(os.getenv("FORECAST_FULL_LEVEL", "100"))  # fill level considered full
+FORECAST_EMPTY_DROP = float(os.getenv("FORECAST_EMPTY_DROP", "30"))  # a drop larger than this is an emptying
+FORECAST_MIN_READINGS = int(os.getenv("FORECAST_MIN_READINGS", "3"))  # per cycle, before predicting
+FORECAST_LOOKBACK_DAYS = int(os.getenv("FORECAST_LOOKBACK_DAYS", "14"))  # history read by the periodic recompute
+
+# --- API Config ---
+READINGS_PAGE_SIZE = int(os.getenv("READINGS_PAGE_SIZE", "1000"))
+READINGS_PAGE_MAX = int(os.getenv("READINGS_PAGE_MAX", "10000"))
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))  # each export holds its own connection, outside the pool
+LIVE_COALESCE_MS = int(os.getenv("LIVE_COALESCE_MS", "1000"))  # /api/live sends at most one event per client per interval
+LIVE_HEARTBEAT_SECONDS = float(os.getenv("LIVE_HEARTBEAT_SECONDS", "15"))
+ROLLUP_MAX_POINTS = int(os.getenv("ROLLUP_MAX_POINTS", "500"))  # per container, for bucket=auto
@@ -0,0 +1,228 @@
+"""
+Wire: formato binario compacto para lecturas (Content-Type application/x-sced)
+
+Used on /push (sensor packets), /api/report and /api/report/batch (edge
+readings) and on the MQTT topic (ContentType property). JSON is still
+accepted everywhere. The same file lives in processing-node/wire.py; keep
+both copies identical (tests/system_test.py checks it).
+
+Layout, little endian:
+
+    header    "SC", version u8, kind u8, string count u16
+    strings   length u8 + UTF-8 bytes each (node, container and sensor ids)
+
+    kind 1, readings:
+      count u32, base timestamp i64 (ms), location count u16, trace count u16
+      locations  node string u16, lon f64, lat f64
+      traces     record index u32, trace id string u16, stage count u8,
+                 stage times f64 (unix seconds) each
+      records    node string u16, container string u16, fill_level f64,
+                 timestamp delta from the previous record i32 (ms),
+                 created_at - timestamp i32 (ms)
+
+    kind 2, sensor packet (strings: sensor id, container id):
+      count u32, base timestamp i64 (s)
+      records    fill_level f64, timestamp delta from the previous record i32 (s)
+
+Timestamps are naive: a UTC offset in the input is dropped, like the
+server's cast to TIMESTAMP does, and millisecond precision is kept.
+"""
+
+import struct
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+CONTENT_TYPE = "application/x-sced"
+VERSION = 2
+KIND_READINGS = 1
+KIND_PACKET = 2
+
+HEADER = struct.Struct("<2sBBH")
+READINGS_HEADER = struct.Struct("<IqHH")
+LOCATION = struct.Struct("<Hdd")
+TRACE = struct.Struct("<IHB")
+READING = struct.Struct("<HHdii")
+PACKET_HEADER = struct.Struct("<Iq")
+MEASUREMENT = struct.Struct("<di")
+
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+class WireError(ValueError):
+    pass
+
+def is_wire(content_type: str | None) -> bool:
+    return bool(content_type) and content_type.split(";")[0].strip().lower() == CONTENT_TYPE
+
+# --- Encoding ---
+def _to_ms(value: str | datetime) -> int:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return (value.replace(tzinfo=None) - EPOCH) // MILLISECOND
+
+def _header(kind: int, strings: list[str]) -> list[bytes]:
+    if len(strings) > 0xFFFF:
+        raise WireError(f"Too many distinct ids ({len(strings)})")
+    parts = [HEADER.pack(b"SC", VERSION, kind, len(strings))]
+    for s in strings:
+        data = s.encode()
+        if len(data) > 0xFF:
+            raise WireError(f"Id longer than 255 bytes: {s[:40]!r}...")
+        parts.append(bytes((len(data),)) + data)
+    return parts
+
+def encode_readings(readings: list[dict]) -> bytes:
+    """
+    Encode readings (node_id, container_id, fill_level, timestamp, created_at
+    and optionally location as a GeoJSON point and a trace, see metrics.py).
+    Raises WireError when a value
+    does not fit the layout, e.g. timestamps more than 24 days apart.
+    """
+    index = {}
+    def intern(s: str) -> int:
+        return index.setdefault(s, len(index))
+
+    parsed = {}
+    def to_ms(value) -> int:
+        ms = parsed.get(value)
+        if ms is None:
+            ms = parsed[value] = _to_ms(value)
+        return ms
+
+    locations = {}
+    traces = []
+    records = []
+    try:
+        previous = base = to_ms(readings[0]["timestamp"]) if readings else 0
+        for i, r in enumerate(readings):
+            node = intern(r["node_id"])
+            if r.get("location"):
+                locations[node] = r["location"]["coordinates"]
+            if r.get("trace"):
+                times = r["trace"]["t"]
+                header = TRACE.pack(i, intern(r["trace"]["id"]), len(times))
+                traces.append(header + struct.pack(f"<{len(times)}d", *times))
+            timestamp = to_ms(r["timestamp"])
+            records.append(READING.pack(
+                node, intern(r["container_id"]), r["fill_level"],
+                timestamp - previous, to_ms(r["created_at"]) - timestamp
+            ))
+            previous = timestamp
+        parts = _header(KIND_READINGS, list(index))
+        parts.append(READINGS_HEADER.pack(len(records), base, len(locations), len(traces)))
+        parts.extend(LOCATION.pack(node, lon, lat) for node, (lon, lat) in locations.items())
+        parts.extend(traces)
+    except (struct.error, KeyError, TypeError, ValueError) as e:
+        raise WireError(f"Cannot encode readings: {e}") from e
+    parts.extend(records)
+    return b"".join(parts)
+
+def encode_packet(sensor_id: str, container_id: str, measurements: list[tuple[float, int]]) -> bytes:
+    """Encode a sensor packet from (fill_level, unix timestamp) pairs."""
+    parts = _header(KIND_PACKET, [sensor_id, container_id])
+    base = previous = measurements[0][1] if measurements else 0
+    parts.append(PACKET_HEADER.pack(len(measurements), base))
+    try:
+        for fill_level, timestamp in measurements:
+            parts.append(MEASUREMENT.pack(fill_level, timestamp - previous))
+            previous = timestamp
+    except struct.error as e:
+        raise WireError(f"Cannot encode packet: {e}") from e
+    return b"".join(parts)
+
+# --- Decoding ---
+def _read_header(data: bytes, kind: int) -> tuple[list[str], int]:
+    try:
+        magic, version, found, count = HEADER.unpack_from(data)
+    except struct.error:
+        raise WireError("Truncated header")
+    if magic != b"SC":
+        raise WireError("Not a sced binary payload")
+    if version != VERSION:
+        raise WireError(f"Unsupported wire format version {version}, expected {VERSION}")
+    if found != kind:
+        raise WireError(f"Expected payload kind {kind}, got {found}")
+    offset = HEADER.size
+    strings = []
+    for _ in range(count):
+        end = offset + 1 + data[offset] if offset < len(data) else -1
+        if end < 0 or end > len(data):
+            raise WireError("Truncated string table")
+        try:
+            strings.append(data[offset + 1:end].decode())
+        except UnicodeDecodeError as e:
+            raise WireError(f"Invalid UTF-8 in string table: {e}") from e
+        offset = end
+    return strings, offset
+
+def decode_readings(data: bytes) -> list[dict]:
+    """Inverse of encode_readings, with ISO 8601 timestamps as in the JSON payloads."""
+    strings, offset = _read_header(data, KIND_READINGS)
+    try:
+        count, base, location_count, trace_count = READINGS_HEADER.unpack_from(data, offset)
+        offset += READINGS_HEADER.size
+        locations = {}
+        for _ in range(location_count):
+            node, lon, lat = LOCATION.unpack_from(data, offset)
+            locations[strings[node]] = {"type": "Point", "coordinates": [lon, lat]}
+            offset += LOCATION.size
+        traces = {}
+        for _ in range(trace_count):
+            index, trace_id, stages = TRACE.unpack_from(data, offset)
+            offset += TRACE.size
+            times = struct.unpack_from(f"<{stages}d", data, offset)
+            traces[index] = {"id": strings[trace_id], "t": list(times)}
+            offset += 8 * stages
+        if len(data) - offset != count * READING.size:
+            raise WireError(f"Expected {count} readings, got {len(data) - offset} bytes")
+        records = list(READING.iter_unpack(data[offset:]))
+        timestamps = accumulate((record[3] for record in records), initial=base)
+        next(timestamps)
+        # Batches repeat the same few window starts and creation times
+        iso = {}
+        def isoformat(ms: int) -> str:
+            value = iso.get(ms)
+            if value is None:
+                value = iso[ms] = (EPOCH + ms * MILLISECOND).isoformat()
+            return value
+        readings = []
+        for (node, container, fill_level, _, created_delta), timestamp in zip(records, timestamps):
+            reading = {
+                "node_id": strings[node],
+                "container_id": strings[container],
+                "fill_level": fill_level,
+                "timestamp": isoformat(timestamp),
+                "created_at": isoformat(timestamp + created_delta),
+            }
+            if locations:
+                reading["location"] = locations.get(reading["node_id"])
+            if traces and len(readings) in traces:
+                reading["trace"] = traces[len(readings)]
+            readings.append(reading)
+    except (struct.error, IndexError, OverflowError) as e:
+        raise WireError(f"Malformed readings payload: {e}") from e
+    return readings
+
+def decode_packet(data: bytes) -> dict:
+    """Inverse of encode_packet, shaped like the JSON packet sent to /push."""
+    strings, offset = _read_header(data, KIND_PACKET)
+    if len(strings) != 2:
+        raise WireError("Packet must carry a sensor id and a container id")
+    try:
+        count, base = PACKET_HEADER.unpack_from(data, offset)
+        offset += PACKET_HEADER.size
+        if len(data) - offset != count * MEASUREMENT.size:
+            raise WireError(f"Expected {count} measurements, got {len(data) - offset} bytes")
+        records = list(MEASUREMENT.iter_unpack(data[offset:]))
+    except struct.error as e:
+        raise WireError(f"Malformed packet: {e}") from e
+    timestamps = accumulate((delta for _, delta in records), initial=base)
+    next(timestamps)
+    return {
+        "sensor_id": strings[0],
+        "container_id": strings[1],
+        "measurements": [
+            {"fill_level": fill_level, "timestamp": timestamp}
+            for (fill_level, _), timestamp in zip(records, timestamps)
+        ],
+    }
@@ -2,20 +2,77 @@
 Worker: procesa datos recibidos por MQTT y los guarda en PostgreSQL/PostGIS
 """
 
+import os
 import signal
 import sys
 import time
 import json
+import threading
+import multiprocessing
+import psycopg2
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 from datetime import datetime
-from app.settings import MQTT_BROKER, MQTT_PORT, MQTT_TOPIC
-from app.db import ensure_tables, get_conn
+from psycopg2.extras import execute_values
+from app.settings import (
+    MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, MQTT_PARTITIONS, MQTT_SHARE_GROUP,
+    MQTT_CLIENT_ID, MQTT_SESSION_EXPIRY,
+    WORKER_MODE, WORKER_BATCH_SIZE, WORKER_FLUSH_INTERVAL_MS, WORKER_STATS_INTERVAL,
+    WORKER_PROCESSES, WORKER_SUBSCRIPTION, WORKER_METRICS_PORT, READINGS_MAINTENANCE_INTERVAL,
+    LOG_SAMPLE_RATE
+)
+from app.db import get_conn, pool_stats, DatabaseUnavailable
+from app.partitions import run_maintenance
+from app.idempotency import expire_batch_keys
+from app.rollups import update_rollups
+from app.latest import update_latest, bump_version
+from app.forecast import update_forecast, run_recompute, FORECAST_VERSION
+from app import wire
+from app.metrics import (
+    Counter, Gauge, Histogram, SIZE_BUCKETS, finish_trace, mark, sampled, serve
+)
+from app.migrate import check_schema
 
-ensure_tables()
+BATCH_MODE = WORKER_MODE == "batch"
 
-client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+# Created in start_worker(), after the launcher forked this process
+client = None
+worker_index = 0
 should_exit = False
 
+# Pending (mid, qos, reading) tuples waiting for the next flush
+pending = []
+pending_cond = threading.Condition()
+stats = {
+    "messages": 0,
+    "batches": 0,
+    "errors": 0,
+    "started_at": time.time(),
+    "last_flush_seconds": 0.0,
+}
+
+# --- Metrics ---
+consumed_total = Counter("sced_mqtt_consumed_total", "MQTT messages received")
+Counter("sced_worker_messages_total", "Messages stored (or discarded as invalid) and acknowledged",
+        collect=lambda: stats["messages"])
+Counter("sced_worker_errors_total", "Failed batch writes", collect=lambda: stats["errors"])
+Gauge("sced_worker_pending", "Messages buffered for the next flush", collect=lambda: len(pending))
+batch_size = Histogram("sced_worker_batch_size", "Messages per flushed batch", buckets=SIZE_BUCKETS)
+flush_seconds = Histogram("sced_worker_flush_seconds", "Time to store and acknowledge one batch")
+
+def finish_traces(readings: list[dict]):
+    for reading in readings:
+        if not reading.get("trace"):
+            continue
+        try:
+            trace = mark(reading["trace"])
+            stages = finish_trace(trace)
+        except (KeyError, TypeError, ValueError):
+            continue
+        print(f"Traza {trace['id']} ({reading['container_id']}): "
+              + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stages.items()))
+
 def ensure_zone_and_node(cur, zone_id: str | None, node_id: str, location: dict):
     # Only insert zone if zone_id is provided
     if zone_id is not None:
@@ -50,9 +107,20 @@ def ensure_container(cur, container_id: str, node_id: str, zone_id: str | None,
                 VALUES (%s, %s, %s, %s, %s)
             """, (container_id, node_id, zone_id, "simulated", datetime.now()))
 
+def decode_message(msg) -> dict:
+    """Reading carried by a message, binary (ContentType set by the ingestor) or JSON."""
+    content_type = getattr(msg.properties, "ContentType", None) if msg.properties else None
+    if wire.is_wire(content_type):
+        readings = wire.decode_readings(msg.payload)
+        if len(readings) != 1:
+            raise wire.WireError(f"Expected one reading per message, got {len(readings)}")
+        return readings[0]
+    return json.loads(msg.payload.decode())
+
 def on_message(client, userdata, msg):
+    consumed_total.inc()
     try:
-        payload = json.loads(msg.payload.decode())
+        payload = decode_message(msg)
         node_id = payload.get("node_id")
         container_id = payload.get("container_id")
         fill_level = payload.get("fill_level")
@@ -79,53 +147,292 @@ def on_message(client, userdata, msg):
                 VALUES (%s, %s, %s, %s)
             """, (container_id, fill_level, timestamp, datetime.now()))
 
+            reading = {
+                "container_id": container_id,
+                "fill_level": fill_level,
+                "timestamp": parse_timestamp(timestamp),
+            }
+            update_rollups(cur, [reading])
+            forecasts_changed = update_forecast(cur, [reading])
+            update_latest(cur, [reading], datetime.now())
+            if forecasts_changed:
+                bump_version(cur, FORECAST_VERSION)
+
             conn.commit()
+        finish_traces([payload])
+        if sampled(LOG_SAMPLE_RATE):
             print(f"Procesado: {container_id} - {fill_level}%")
 
     except Exception as e:
         print(f"Error procesando mensaje: {e}")
 
-def on_disconnect(client, userdata, reason_code, properties=None):
-    if reason_code != 0:
-        print("MQTT disconnected unexpectedly. Trying to reconnect...")
-        while not should_exit:
+# --- Batch mode ---
+def parse_timestamp(value: str) -> datetime:
+    # Same as PostgreSQL's cast to TIMESTAMP: any UTC offset is ignored
+    return datetime.fromisoformat(value).replace(tzinfo=None)
+
+def parse_reading(payload: dict) -> dict | None:
+    reading = {
+        "node_id": payload.get("node_id"),
+        "container_id": payload.get("container_id"),
+        "fill_level": payload.get("fill_level"),
+        "timestamp": payload.get("timestamp"),
+        "location": payload.get("location"),
+        "trace": payload.get("trace"),
+    }
+    if not reading["node_id"] or not reading["container_id"] or not reading["timestamp"]:
+        return None
+    if reading["fill_level"] is None:
+        return None
+    try:
+        reading["timestamp"] = parse_timestamp(reading["timestamp"])
+    except (TypeError, ValueError):
+        return None
+    return reading
+
+def _lon_lat(location: dict | None):
+    if location:
+        lon, lat = location["coordinates"]
+        return lon, lat
+    return None, None
+
+def write_batch(readings: list[dict]):
+    """Upsert nodes and containers and insert all readings in a single transaction."""
+    now = datetime.now()
+    nodes = {}
+    containers = {}
+    for r in readings:
+        nodes.setdefault(r["node_id"], r["location"])
+        containers.setdefault(r["container_id"], (r["node_id"], r["location"]))
+
+    with get_conn() as conn:
+        cur = conn.cursor()
+
+        execute_values(cur, """
+            INSERT INTO processor_nodes (id, location)
+            VALUES %s
+            ON CONFLICT (id) DO NOTHING
+        """, [(node_id, *_lon_lat(loc)) for node_id, loc in nodes.items()],
+            template="(%s, ST_SetSRID(ST_MakePoint(%s, %s), 4326))")
+
+        # New containers inherit the zone of their node
+        execute_values(cur, """
+            INSERT INTO containers (id, node_id, zone_id, type, created_at, location)
+            SELECT v.id, v.node_id, n.zone_id, 'simulated', v.created_at,
+                   ST_SetSRID(ST_MakePoint(v.lon, v.lat), 4326)
+            FROM (VALUES %s) AS v (id, node_id, created_at, lon, lat)
+            LEFT JOIN processor_nodes n ON n.id = v.node_id
+            ON CONFLICT (id) DO NOTHING
+        """, [(cid, node_id, now, *_lon_lat(loc)) for cid, (node_id, loc) in containers.items()],
+            template="(%s, %s, %s::timestamp, %s::float8, %s::float8)")
+
+        execute_values(cur, """
+            INSERT INTO container_readings (container_id, fill_level, timestamp, received_at)
+            VALUES %s
+        """, [(r["container_id"], r["fill_level"], r["timestamp"], now) for r in readings],
+            page_size=len(readings))
+
+        update_rollups(cur, readings)
+        forecasts_changed = update_forecast(cur, readings)
+        # Last: the version bumps take row locks held until commit
+        update_latest(cur, readings, now)
+        if forecasts_changed:
+            bump_version(cur, FORECAST_VERSION)
+
+        conn.commit()
+
+def ack(entries):
+    for mid, qos, _ in entries:
+        client.ack(mid, qos)
+
+def flush_batch(batch):
+    started = time.perf_counter()
+    try:
+        write_batch([reading for _, _, reading in batch])
+    except (psycopg2.OperationalError, DatabaseUnavailable) as e:
+        # Database unreachable: keep the messages and retry them on the next flush
+        print(f"Error escribiendo lote ({len(batch)} mensajes), reintentando: {e}")
+        stats["errors"] += 1
+        if not should_exit:
+            with pending_cond:
+                pending[:0] = batch
+            time.sleep(1)
+        return
+    except Exception as e:
+        # Bad data somewhere in the batch: isolate it by writing row by row
+        print(f"Error escribiendo lote ({len(batch)} mensajes), aislando filas: {e}")
+        stats["errors"] += 1
+        for entry in batch:
             try:
-                client.reconnect()
-                print("Reconnected to MQTT broker.")
-                break
-            except Exception as e:
-                print(f"Reconnect failed: {e}")
-                time.sleep(5)
+                write_batch([entry[2]])
+            except Exception as row_error:
+                print(f"Descartando mensaje {entry[2]}: {row_error}")
+    ack(batch)
+    finish_traces([reading for _, _, reading in batch])
+    stats["messages"] += len(batch)
+    stats["batches"] += 1
+    stats["last_flush_seconds"] = time.perf_counter() - started
+    batch_size.observe(len(batch))
+    flush_seconds.observe(stats["last_flush_seconds"])
+
+def get_stats() -> dict:
+    elapsed = max(time.time() - stats["started_at"], 1e-9)
+    return {
+        **stats,
+        "pending": len(pending),
+        "messages_per_second": stats["messages"] / elapsed,
+        "avg_batch_size": stats["messages"] / stats["batches"] if stats["batches"] else 0.0,
+        "db_pool": pool_stats(),
+    }
+
+def flush_loop():
+    interval = WORKER_FLUSH_INTERVAL_MS / 1000
+    last_report = time.time()
+    last_messages = 0
+    while True:
+        with pending_cond:
+            pending_cond.wait_for(lambda: len(pending) >= WORKER_BATCH_SIZE or should_exit, timeout=interval)
+            batch = pending[:WORKER_BATCH_SIZE]
+            del pending[:WORKER_BATCH_SIZE]
+        if batch:
+            flush_batch(batch)
+        elif should_exit:
+            break
+
+        if time.time() - last_report >= WORKER_STATS_INTERVAL:
+            rate = (stats["messages"] - last_messages) / (time.time() - last_report)
+            db = pool_stats()
+            print(f"[worker {worker_index}] Throughput: {rate:.1f} msg/s, pendientes: {len(pending)}, lotes: {stats['batches']}, "
+                  f"db en uso: {db['in_use']}/{db['size']}, espera media: {db['acquire_avg_ms']:.1f} ms")
+            last_report = time.time()
+            last_messages = stats["messages"]
+
+def on_message_batch(client, userdata, msg):
+    consumed_total.inc()
+    try:
+        reading = parse_reading(decode_message(msg))
+    except Exception as e:
+        print(f"Error procesando mensaje: {e}")
+        reading = None
+    if reading is None:
+        # Nothing to retry for malformed messages
+        client.ack(msg.mid, msg.qos)
+        return
+    with pending_cond:
+        pending.append((msg.mid, msg.qos, reading))
+        if len(pending) >= WORKER_BATCH_SIZE:
+            pending_cond.notify()
+
+flusher = threading.Thread(target=flush_loop, name="worker-flusher")
+
+# --- Storage maintenance ---
+def maintenance_loop():
+    # Runs right away: app.migrate created partitions ahead, but possibly long ago
+    while not should_exit:
+        try:
+            run_maintenance()
+        except Exception as e:
+            print(f"Error en mantenimiento de particiones: {e}")
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    expired = expire_batch_keys(cur)
+            if expired:
+                print(f"Expired {expired} ingest batch keys")
+        except Exception as e:
+            print(f"Error expirando claves de lotes: {e}")
+        try:
+            rebuilt = run_recompute()
+            print(f"Recomputed the forecast of {rebuilt} containers")
+        except Exception as e:
+            print(f"Error recalculando pronósticos: {e}")
+        time.sleep(READINGS_MAINTENANCE_INTERVAL)
+
+# --- MQTT session ---
+def subscriptions(index: int, count: int) -> list[tuple[str, int]]:
+    if WORKER_SUBSCRIPTION == "partitioned":
+        topics = [f"{MQTT_TOPIC}/{p}" for p in range(MQTT_PARTITIONS) if p % count == index]
+        if index == 0:
+            # Publishers still using the bare topic
+            topics.append(MQTT_TOPIC)
+    else:
+        # The broker hands each message to one member of the group; '#' also matches the bare topic
+        topics = [f"$share/{MQTT_SHARE_GROUP}/{MQTT_TOPIC}/#"]
+    return [(topic, 1) for topic in topics]
+
+def on_connect(client, userdata, flags, reason_code, properties):
+    if reason_code.is_failure:
+        print(f"MQTT connection refused: {reason_code}")
+        return
+    # The persistent session normally keeps them, subscribing again is harmless
+    topics = userdata["subscriptions"]
+    client.subscribe(topics)
+    print(f"Connected to MQTT broker (session present: {flags.session_present}), "
+          f"subscribed to: {', '.join(topic for topic, _ in topics)}")
+
+def on_disconnect(client, userdata, flags, reason_code, properties):
+    if reason_code != 0:
+        # The network loop reconnects by itself and the broker kept our session
+        print(f"MQTT disconnected unexpectedly ({reason_code}), reconnecting...")
+
+def make_client(index: int, count: int) -> mqtt.Client:
+    # In batch mode messages are acknowledged only once their batch is committed
+    mqtt_client = mqtt.Client(
+        mqtt.CallbackAPIVersion.VERSION2,
+        client_id=f"{MQTT_CLIENT_ID}-{index}",
+        protocol=mqtt.MQTTv5,
+        manual_ack=BATCH_MODE,
+        userdata={"subscriptions": subscriptions(index, count)},
+    )
+    mqtt_client.reconnect_delay_set(min_delay=1, max_delay=30)
+    mqtt_client.on_connect = on_connect
+    mqtt_client.on_disconnect = on_disconnect
+    mqtt_client.on_message = on_message_batch if BATCH_MODE else on_message
+    return mqtt_client
 
 def signal_handler(sig, frame):
     global should_exit
     print("Signal received, shutting down gracefully...")
     should_exit = True
+    if flusher.is_alive():
+        # Drain buffered messages (and ack them) before leaving
+        with pending_cond:
+            pending_cond.notify()
+        flusher.join()
     client.loop_stop()
     client.disconnect()
     sys.exit(0)
 
-def start_worker():
-    global client
+def start_worker(index: int = 0, count: int = 1):
+    global client, worker_index
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
-    client.on_message = on_message
-    client.on_disconnect = on_disconnect
+    worker_index = index
+    client = make_client(index, count)
+    if WORKER_METRICS_PORT:
+        serve(WORKER_METRICS_PORT + index)
+
+    # Persistent session: QoS 1 messages published while we are down are kept by the broker
+    properties = Properties(PacketTypes.CONNECT)
+    properties.SessionExpiryInterval = MQTT_SESSION_EXPIRY
 
     # Retry until connected (initial attempt)
     while not should_exit:
         try:
-            client.connect(MQTT_BROKER, MQTT_PORT, 60)
-            print("Connected to MQTT broker.")
+            client.connect(MQTT_BROKER, MQTT_PORT, 60, clean_start=False, properties=properties)
             break
         except Exception as e:
             print(f"Initial MQTT connection failed: {e}")
             time.sleep(5)
 
-    client.subscribe(MQTT_TOPIC)
-    print("Subscribed to topic:", MQTT_TOPIC)
+    if BATCH_MODE:
+        flusher.start()
+        print(f"Batch mode: {WORKER_BATCH_SIZE} messages / {WORKER_FLUSH_INTERVAL_MS} ms")
+
+    if index == 0:
+        threading.Thread(target=maintenance_loop, name="worker-maintenance", daemon=True).start()
 
     client.loop_start()
 
@@ -133,5 +440,44 @@ def start_worker():
     while not should_exit:
         signal.pause()
 
+# --- Multiprocess launcher ---
+def run_workers(count: int):
+    """Run `count` worker processes and restart any that dies."""
+    processes = {}
+    stopping = False
+
+    def spawn(index: int):
+        process = multiprocessing.Process(target=start_worker, args=(index, count), name=f"worker-{index}")
+        process.start()
+        processes[index] = process
+
+    def stop(sig, frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f"Starting {count} worker processes ({WORKER_SUBSCRIPTION} subscription)")
+    for index in range(count):
+        spawn(index)
+    while not stopping:
+        time.sleep(1)
+        for index, process in list(processes.items()):
+            if not process.is_alive() and not stopping:
+                print(f"Worker {index} exited with code {process.exitcode}, restarting")
+                spawn(index)
+    for process in processes.values():
+        process.join()
+
 if __name__ == "__main__":
-    start_worker()
\ No newline at end of file
+    # Once, before forking: the workers share the result
+    check_schema()
+    processes = WORKER_PROCESSES or os.cpu_count()
+    if processes == 1:
+        start_worker()
+    else:
+        run_workers(processes)
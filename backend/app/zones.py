@@ -0,0 +1,68 @@
+"""
+Zones: GeoJSON de zonas simplificado por nivel de zoom, cacheado en memoria
+
+Each zoom level is computed once, simplified to about one screen pixel and
+rounded to the precision that pixel needs, then served from memory with an
+ETag. A trigger on zones sends NOTIFY zones_changed, which drops the cache.
+"""
+
+import hashlib
+import json
+import math
+import threading
+from app.db import get_conn
+
+ZONES_CHANNEL = "zones_changed"
+MAX_ZOOM = 22
+
+_cache = {}  # zoom (None = full precision) -> (etag, body)
+_lock = threading.Lock()
+_generation = 0
+
+def tolerance(zoom: int) -> float:
+    """Degrees covered by one 256 px tile pixel at this zoom (at the equator)."""
+    return 360 / (256 * 2 ** zoom)
+
+def load_zones(zoom: int | None) -> bytes:
+    if zoom is None:
+        geometry, params = "ST_AsGeoJSON(boundary::geometry)", []
+    else:
+        tol = tolerance(zoom)
+        # Enough decimals to place a vertex within a tenth of a pixel
+        digits = max(0, math.ceil(-math.log10(tol / 10)))
+        geometry = "ST_AsGeoJSON(ST_SimplifyPreserveTopology(boundary::geometry, %s), %s)"
+        params = [tol, digits]
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT id, name, {geometry} FROM zones ORDER BY id", params)
+            rows = cur.fetchall()
+    # GeoJSON is spliced in as text, no need to parse it
+    return ("[" + ",".join(
+        f'{{"id":{json.dumps(zone_id)},"name":{json.dumps(name)},"boundary":{geojson or "null"}}}'
+        for zone_id, name, geojson in rows
+    ) + "]").encode()
+
+def get_zones(zoom: int | None) -> tuple[str, bytes]:
+    """(etag, JSON body) of every zone at this zoom level."""
+    if zoom is not None:
+        zoom = min(max(zoom, 0), MAX_ZOOM)
+    with _lock:
+        cached = _cache.get(zoom)
+        generation = _generation
+    if cached is not None:
+        return cached
+
+    body = load_zones(zoom)
+    etag = f'W/"zones-{zoom if zoom is not None else "full"}-{hashlib.sha1(body).hexdigest()[:16]}"'
+    with _lock:
+        # Not cached if the zones changed while we were reading them
+        if generation == _generation:
+            _cache[zoom] = (etag, body)
+    return etag, body
+
+def invalidate(payload=None):
+    """NOTIFY callback: any change, or a listener reconnect (None), drops every level."""
+    global _generation
+    with _lock:
+        _generation += 1
+        _cache.clear()
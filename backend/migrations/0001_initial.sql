@@ -0,0 +1,176 @@
+-- Baseline: the schema previously applied by every service on startup.
+-- Idempotent, so databases created that way are brought under version
+-- control by simply recording it. Never edit an applied migration; add a
+-- new NNNN_description.sql instead (see app/migrate.py).
+
+-- === Schema Definitions ===
+CREATE TABLE IF NOT EXISTS zones (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    boundary GEOGRAPHY(POLYGON)
+);
+
+CREATE TABLE IF NOT EXISTS processor_nodes (
+    id TEXT PRIMARY KEY,
+    zone_id TEXT REFERENCES zones(id),
+    location GEOGRAPHY(POINT)
+);
+
+CREATE TABLE IF NOT EXISTS containers (
+    id TEXT PRIMARY KEY,
+    node_id TEXT REFERENCES processor_nodes(id),
+    zone_id TEXT REFERENCES zones(id),
+    type TEXT,
+    location GEOGRAPHY(POINT),
+    created_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS level_data (
+    id SERIAL PRIMARY KEY,
+    node_id TEXT REFERENCES processor_nodes(id),
+    container_id TEXT REFERENCES containers(id),
+    timestamp TIMESTAMP,
+    fill_level FLOAT,
+    location GEOGRAPHY(POINT),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Databases created before partitioning: keep the old table aside so
+-- app.partitions can move its rows into the partitioned one
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'container_readings' AND relkind = 'r') THEN
+        ALTER TABLE container_readings RENAME TO container_readings_legacy;
+        ALTER SEQUENCE IF EXISTS container_readings_id_seq RENAME TO container_readings_legacy_id_seq;
+    END IF;
+END $$;
+
+-- Range partitioned by reading time; app.partitions creates the partitions
+-- ahead of time and drops expired ones
+CREATE TABLE IF NOT EXISTS container_readings (
+    id BIGSERIAL,
+    container_id TEXT REFERENCES containers(id),
+    fill_level FLOAT NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    received_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Catches readings with timestamps outside the created partitions (e.g. bad clocks)
+CREATE TABLE IF NOT EXISTS container_readings_default PARTITION OF container_readings DEFAULT;
+
+CREATE INDEX IF NOT EXISTS idx_containers_location ON containers USING GIST (location);
+CREATE INDEX IF NOT EXISTS idx_containers_zone_id ON containers (zone_id);
+CREATE INDEX IF NOT EXISTS idx_container_readings_container_ts ON container_readings (container_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_container_readings_ts_brin ON container_readings USING BRIN (timestamp);
+CREATE INDEX IF NOT EXISTS idx_container_readings_ts_id ON container_readings (timestamp, id);
+
+-- Pre-aggregated fill levels per container and bucket ('1m', '1h', '1d'),
+-- maintained incrementally by the worker; avg = sum_level / count
+CREATE TABLE IF NOT EXISTS container_rollups (
+    bucket TEXT NOT NULL,
+    container_id TEXT NOT NULL REFERENCES containers(id),
+    bucket_start TIMESTAMP NOT NULL,
+    min_level FLOAT NOT NULL,
+    max_level FLOAT NOT NULL,
+    sum_level FLOAT NOT NULL,
+    count INTEGER NOT NULL,
+    last_level FLOAT NOT NULL,
+    last_timestamp TIMESTAMP NOT NULL,
+    PRIMARY KEY (bucket, container_id, bucket_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_container_rollups_bucket_start ON container_rollups (bucket, bucket_start);
+
+-- Newest reading per container with its location pre-joined, maintained by the worker
+CREATE TABLE IF NOT EXISTS container_latest (
+    container_id TEXT PRIMARY KEY REFERENCES containers(id),
+    node_id TEXT,
+    zone_id TEXT,
+    fill_level FLOAT NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    received_at TIMESTAMP NOT NULL,
+    lon FLOAT,
+    lat FLOAT
+);
+
+-- Change counters used as ETags; bumped by the writer in the same transaction
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO data_versions (name) VALUES ('container_latest') ON CONFLICT (name) DO NOTHING;
+
+-- Idempotency keys of batches accepted from processing nodes, so retried
+-- uploads are not published twice; expired by the worker's maintenance loop
+CREATE TABLE IF NOT EXISTS ingest_batches (
+    key TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    received_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingest_batches_received_at ON ingest_batches (received_at);
+
+-- Backfill container_latest the first time it is created
+INSERT INTO container_latest (container_id, node_id, zone_id, fill_level, timestamp, received_at, lon, lat)
+SELECT DISTINCT ON (cr.container_id)
+    cr.container_id, c.node_id, c.zone_id, cr.fill_level, cr.timestamp, cr.received_at,
+    ST_X(c.location::geometry), ST_Y(c.location::geometry)
+FROM container_readings cr
+JOIN containers c ON c.id = cr.container_id
+WHERE NOT EXISTS (SELECT 1 FROM container_latest)
+ORDER BY cr.container_id, cr.timestamp DESC;
+
+-- === Change Notifications ===
+
+-- Lets services holding cached node data (e.g. the ingestor) invalidate it
+CREATE OR REPLACE FUNCTION notify_processor_node_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('processor_nodes_changed', COALESCE(NEW.id, OLD.id));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER processor_nodes_changed
+AFTER INSERT OR UPDATE OR DELETE ON processor_nodes
+FOR EACH ROW EXECUTE FUNCTION notify_processor_node_change();
+
+-- Lets API processes drop their cached, simplified zone GeoJSON (app/zones.py)
+CREATE OR REPLACE FUNCTION notify_zone_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('zones_changed', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER zones_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON zones
+FOR EACH STATEMENT EXECUTE FUNCTION notify_zone_change();
+
+-- === Sample Data Inserts ===
+
+-- Insert sample zone for Graneros
+INSERT INTO zones (id, name, boundary) VALUES
+('ZONA-GRANEROS-CL-VI', 'Graneros, O’Higgins, Chile',
+ ST_GeogFromText(
+   'POLYGON((' ||
+   '-70.7400 -34.0750, ' ||
+   '-70.7200 -34.0750, ' ||
+   '-70.7200 -34.0600, ' ||
+   '-70.7400 -34.0600, ' ||
+   '-70.7400 -34.0750))'
+ ))
+ON CONFLICT (id) DO NOTHING;
+
+-- Insert one processor node within the zone
+INSERT INTO processor_nodes (id, zone_id, location) VALUES
+('NODO-GR-001', 'ZONA-GRANEROS-CL-VI',
+ ST_GeogFromText('POINT(-70.7300 -34.0675)'))
+ON CONFLICT (id) DO NOTHING;
+
+-- Insert one container at the same location as the node
+INSERT INTO containers (id, node_id, zone_id, type, location, created_at) VALUES
+('CONTENEDOR-GR-C001', 'NODO-GR-001', 'ZONA-GRANEROS-CL-VI',
+ 'mixed', ST_GeogFromText('POINT(-70.7300 -34.0675)'), NOW())
+ON CONFLICT (id) DO NOTHING;
\ No newline at end of file
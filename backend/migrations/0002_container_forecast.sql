@@ -0,0 +1,17 @@
+-- Fill-rate regression state per container, maintained by the worker (app/forecast.py).
+-- One least-squares fit of fill_level over t = seconds since cycle_start,
+-- kept as running sums; a new cycle starts when the container is emptied.
+CREATE TABLE IF NOT EXISTS container_forecast (
+    container_id TEXT PRIMARY KEY REFERENCES containers(id),
+    cycle_start TIMESTAMP,
+    n INTEGER NOT NULL DEFAULT 0,
+    sum_t FLOAT NOT NULL DEFAULT 0,
+    sum_y FLOAT NOT NULL DEFAULT 0,
+    sum_tt FLOAT NOT NULL DEFAULT 0,
+    sum_ty FLOAT NOT NULL DEFAULT 0,
+    last_level FLOAT,
+    last_timestamp TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+INSERT INTO data_versions (name) VALUES ('container_forecast') ON CONFLICT (name) DO NOTHING;
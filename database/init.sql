@@ -37,14 +37,67 @@ CREATE TABLE IF NOT EXISTS level_data (
 );
 
 -- Tabla de datos de lecturas (container_readings)
+-- Particionada por rango de tiempo; las particiones las crea app.partitions
 CREATE TABLE IF NOT EXISTS container_readings (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     container_id TEXT REFERENCES containers(id),
     fill_level FLOAT NOT NULL,
     timestamp TIMESTAMP NOT NULL,
-    received_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-);
+    received_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE IF NOT EXISTS container_readings_default PARTITION OF container_readings DEFAULT;
 
 -- Índices recomendados
 CREATE INDEX IF NOT EXISTS idx_level_data_timestamp ON level_data(timestamp);
 CREATE INDEX IF NOT EXISTS idx_containers_location ON containers USING GIST (location);
+CREATE INDEX IF NOT EXISTS idx_containers_zone_id ON containers (zone_id);
+CREATE INDEX IF NOT EXISTS idx_container_readings_container_ts ON container_readings (container_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_container_readings_ts_brin ON container_readings USING BRIN (timestamp);
+CREATE INDEX IF NOT EXISTS idx_container_readings_ts_id ON container_readings (timestamp, id);
+
+-- Agregados por contenedor y bucket ('1m', '1h', '1d'), mantenidos por el worker
+CREATE TABLE IF NOT EXISTS container_rollups (
+    bucket TEXT NOT NULL,
+    container_id TEXT NOT NULL REFERENCES containers(id),
+    bucket_start TIMESTAMP NOT NULL,
+    min_level FLOAT NOT NULL,
+    max_level FLOAT NOT NULL,
+    sum_level FLOAT NOT NULL,
+    count INTEGER NOT NULL,
+    last_level FLOAT NOT NULL,
+    last_timestamp TIMESTAMP NOT NULL,
+    PRIMARY KEY (bucket, container_id, bucket_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_container_rollups_bucket_start ON container_rollups (bucket, bucket_start);
+
+-- Última lectura por contenedor con su ubicación, mantenida por el worker
+CREATE TABLE IF NOT EXISTS container_latest (
+    container_id TEXT PRIMARY KEY REFERENCES containers(id),
+    node_id TEXT,
+    zone_id TEXT,
+    fill_level FLOAT NOT NULL,
+    timestamp TIMESTAMP NOT NULL,
+    received_at TIMESTAMP NOT NULL,
+    lon FLOAT,
+    lat FLOAT
+);
+
+-- Contadores de versión usados como ETag
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO data_versions (name) VALUES ('container_latest') ON CONFLICT (name) DO NOTHING;
+
+-- Claves de idempotencia de lotes recibidos desde los nodos de procesamiento
+CREATE TABLE IF NOT EXISTS ingest_batches (
+    key TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    received_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingest_batches_received_at ON ingest_batches (received_at);
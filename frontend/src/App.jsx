@@ -55,6 +55,13 @@ const ReadingSchema = z.object({
 
 const ReadingsSchema = z.array(ReadingSchema);
 
+// Readings kept in memory while live updates keep arriving
+const LIVE_READINGS_MAX = 5000;
+// Rows per /api/readings request while following X-Next-Cursor
+const READINGS_PAGE_SIZE = 1000;
+// Zone boundaries are requested already simplified for this zoom level
+const MAP_ZOOM = 14;
+
 const ZoneSchema = z.object({
   id: z.string(),
   name: z.string(),
@@ -72,6 +79,22 @@ export default function App() {
   const [selectedTime, setSelectedTime] = useState("");
   const [view, setView] = useState("map");
 
+  // Follows X-Next-Cursor until every matching reading, up to LIVE_READINGS_MAX, is loaded
+  const fetchAllReadings = async (queryParams) => {
+    const rows = [];
+    let after = null;
+    while (rows.length < LIVE_READINGS_MAX) {
+      const params = new URLSearchParams(queryParams);
+      params.set("limit", String(Math.min(READINGS_PAGE_SIZE, LIVE_READINGS_MAX - rows.length)));
+      if (after) params.set("after", after);
+      const r = await fetch(`/api/readings?${params.toString()}`);
+      rows.push(...(await r.json()));
+      after = r.headers.get("X-Next-Cursor");
+      if (!after) break;
+    }
+    return rows;
+  };
+
   const fetchReadings = () => {
     const queryParams = new URLSearchParams();
     if (selectedTime) {
@@ -79,8 +102,7 @@ export default function App() {
       queryParams.set("range_seconds", "600"); // ±5 minutes
     }
 
-    fetch(`/api/readings?${queryParams.toString()}`)
-      .then((r) => r.json())
+    fetchAllReadings(queryParams)
       .then((data) => {
         try {
           const parsed = ReadingsSchema.parse(data);
@@ -103,7 +125,7 @@ export default function App() {
   };
 
   const fetchZones = () => {
-    fetch("/api/zones")
+    fetch(`/api/zones?zoom=${MAP_ZOOM}`)
       .then((r) => r.json())
       .then((data) => {
         try {
@@ -116,11 +138,52 @@ export default function App() {
       .catch((err) => console.error("Zones fetch error:", err));
   };
 
+  // Rows pushed by /api/live (latest reading of each changed container)
+  const mergeLive = (rows) => {
+    const valid = rows.filter((r) => ReadingSchema.safeParse(r).success);
+    if (valid.length === 0) return;
+    setReadings((current) => {
+      const seen = new Set(current.map((r) => `${r.container_id}|${r.timestamp}`));
+      const added = valid.filter((r) => !seen.has(`${r.container_id}|${r.timestamp}`));
+      return current.concat(added).slice(-LIVE_READINGS_MAX);
+    });
+    setTimestamps((current) =>
+      Array.from(new Set([...current, ...valid.map((r) => r.timestamp)])).sort()
+    );
+  };
+
   useEffect(() => {
     fetchReadings();
     fetchZones();
-    const id = setInterval(fetchReadings, 30000);
-    return () => clearInterval(id);
+
+    // Server-sent events; polling every 30 s only while the stream is down
+    let pollId = null;
+    const startPolling = () => {
+      if (pollId === null) pollId = setInterval(fetchReadings, 30000);
+    };
+    const stopPolling = () => {
+      clearInterval(pollId);
+      pollId = null;
+    };
+    if (typeof EventSource === "undefined") {
+      startPolling();
+      return stopPolling;
+    }
+
+    const source = new EventSource("/api/live");
+    source.onopen = () => {
+      // Back after an outage: reload what was missed
+      if (pollId !== null) fetchReadings();
+      stopPolling();
+    };
+    // EventSource reconnects by itself, meanwhile we poll
+    source.onerror = startPolling;
+    source.addEventListener("update", (e) => mergeLive(JSON.parse(e.data)));
+    source.addEventListener("resync", fetchReadings);
+    return () => {
+      source.close();
+      stopPolling();
+    };
   }, []);
 
   const filtered = selectedTime
@@ -161,7 +224,7 @@ export default function App() {
       </div>
 
       {view === "map" && (
-        <MapContainer center={[-34.07, -70.73]} zoom={14} style={{ flex: 1 }}>
+        <MapContainer center={[-34.07, -70.73]} zoom={MAP_ZOOM} style={{ flex: 1 }}>
           <TileLayer url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png" />
 
           {zones.map((zone) => (
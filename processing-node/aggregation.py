@@ -0,0 +1,36 @@
+"""
+Window functions used to collapse the raw readings of one container into a
+single level. Every reducer receives the values of a window sorted ascending.
+"""
+
+import math
+import statistics
+
+def mean(values: list[float]) -> float:
+    return math.fsum(values) / len(values)
+
+def median(values: list[float]) -> float:
+    return statistics.median(values)
+
+def trimmed_mean(values: list[float], trim: float = 0.1) -> float:
+    """Mean after dropping the lowest and highest `trim` fraction (noisy echoes)."""
+    cut = int(len(values) * trim)
+    kept = values[cut:len(values) - cut] or values
+    return math.fsum(kept) / len(kept)
+
+def maximum(values: list[float]) -> float:
+    return values[-1]
+
+WINDOW_FUNCTIONS = {
+    "mean": mean,
+    "median": median,
+    "trimmed_mean": trimmed_mean,
+    "max": maximum,
+}
+
+def get_window_function(name: str, trim: float = 0.1):
+    if name not in WINDOW_FUNCTIONS:
+        raise ValueError(f"Unknown window function {name!r}, expected one of {sorted(WINDOW_FUNCTIONS)}")
+    if name == "trimmed_mean":
+        return lambda values: trimmed_mean(values, trim)
+    return WINDOW_FUNCTIONS[name]
@@ -0,0 +1,95 @@
+"""
+Bounded in-memory queue between /push and the database writer task.
+
+Both sides run on the event loop, so no locking is needed. Capacity is
+counted in measurements, not packets, since that is what the writer pays for.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+class IngestQueue:
+    def __init__(self, max_measurements: int, rate_window: float = 60.0):
+        self.max_measurements = max_measurements
+        self.rate_window = rate_window
+        self.items = deque()  # (packet, measurement count)
+        self.measurements = 0
+        self.closed = False
+        self.event = asyncio.Event()
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.dropped = 0
+        self.last_batch_ms = 0.0
+        self.recent = deque()  # (monotonic time, measurements written)
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, packet, size: int) -> bool:
+        """Enqueue packet; False if it does not fit right now (backpressure)."""
+        if self.closed or self.measurements + size > self.max_measurements:
+            self.rejected += size
+            return False
+        self.items.append((packet, size))
+        self.measurements += size
+        self.accepted += size
+        self.event.set()
+        return True
+
+    def take(self, max_measurements: int) -> list:
+        """Pop packets up to max_measurements (always at least one packet)."""
+        packets = []
+        taken = 0
+        while self.items and (not packets or taken + self.items[0][1] <= max_measurements):
+            packet, size = self.items.popleft()
+            packets.append((packet, size))
+            taken += size
+        self.measurements -= taken
+        if not self.items:
+            self.event.clear()
+        return packets
+
+    def requeue(self, packets: list):
+        """Put packets back at the head, e.g. after a failed write."""
+        for packet, size in reversed(packets):
+            self.items.appendleft((packet, size))
+            self.measurements += size
+        if self.items:
+            self.event.set()
+
+    async def wait(self) -> bool:
+        """Wait for packets. False once the queue is closed and empty."""
+        while not self.items:
+            if self.closed:
+                return False
+            await self.event.wait()
+        return True
+
+    def close(self):
+        self.closed = True
+        self.event.set()
+
+    def record_written(self, measurements: int, elapsed: float):
+        now = time.monotonic()
+        self.written += measurements
+        self.last_batch_ms = elapsed * 1000
+        self.recent.append((now, measurements))
+        while self.recent and self.recent[0][0] < now - self.rate_window:
+            self.recent.popleft()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        recent = sum(n for t, n in self.recent if t >= now - self.rate_window)
+        return {
+            "depth_packets": len(self.items),
+            "depth_measurements": self.measurements,
+            "capacity_measurements": self.max_measurements,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "written": self.written,
+            "dropped": self.dropped,
+            "drain_rate": round(recent / self.rate_window, 1),  # measurements/s over rate_window
+            "last_batch_ms": round(self.last_batch_ms, 1),
+        }
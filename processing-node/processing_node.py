@@ -1,19 +1,31 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.routing import APIRoute
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from typing import List
+from typing import Callable, List
 from datetime import datetime, timedelta
 from sqlalchemy import (
     create_engine, Column, String, Integer,
-    Float, Boolean, TIMESTAMP, ForeignKey, func
+    Float, Boolean, TIMESTAMP, ForeignKey, Index, func,
+    update, insert, delete, select, bindparam, event, cast, inspect
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.exc import OperationalError
+from itertools import groupby
+from operator import itemgetter
+import asyncio
 import threading
 import time
 import os
-import requests
 import pytz
 import logging
+from aggregation import get_window_function
+from uplink import Uplink, RateLimiter, batch_key
+from ingest_queue import IngestQueue
+import wire
+from metrics import Counter, Gauge, Histogram, SIZE_BUCKETS, instrument, mark, sampled, start_trace
 
 # --- Logging setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
@@ -22,12 +34,58 @@ logger = logging.getLogger(__name__)
 # --- Config ---
 NODE_ID = os.getenv("NODE_ID", "unkown")
 CENTRAL_SERVER_URL = os.getenv("CENTRAL_SERVER_URL", "http://central-server:8000/receive")
+CENTRAL_SERVER_BATCH_URL = os.getenv("CENTRAL_SERVER_BATCH_URL", CENTRAL_SERVER_URL.rstrip("/") + "/batch")
+UPLINK_BATCH_SIZE = int(os.getenv("UPLINK_BATCH_SIZE", "500"))
+UPLINK_MAX_INFLIGHT = int(os.getenv("UPLINK_MAX_INFLIGHT", "2"))
+UPLINK_MAX_RETRIES = int(os.getenv("UPLINK_MAX_RETRIES", "5"))
+UPLINK_TIMEOUT = float(os.getenv("UPLINK_TIMEOUT", "10"))
+UPLINK_FORMAT = os.getenv("UPLINK_FORMAT", "json")  # "binary" needs a central server that understands wire.py
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))  # seconds between drains
+OUTBOX_DRAIN_RATE = float(os.getenv("OUTBOX_DRAIN_RATE", "1000"))  # levels/s sent while catching up, 0 = unlimited
+OUTBOX_MAX_PENDING = int(os.getenv("OUTBOX_MAX_PENDING", "200000"))  # unsent levels before compaction, 0 = never
+OUTBOX_COMPACT_BUCKET = int(os.getenv("OUTBOX_COMPACT_BUCKET", "900"))  # seconds merged into one level
+OUTBOX_COMPACT_CHUNK = int(os.getenv("OUTBOX_COMPACT_CHUNK", "20000"))  # rows loaded per compaction pass
+OUTBOX_SENT_RETENTION_HOURS = int(os.getenv("OUTBOX_SENT_RETENTION_HOURS", "48"))
+OUTBOX_MAX_REJECTIONS = int(os.getenv("OUTBOX_MAX_REJECTIONS", "5"))  # rejected uploads before a level is dead-lettered
 TIMEZONE = os.getenv("TZ", "America/Santiago")
 TZ = pytz.timezone(TIMEZONE)
+# Window function applied to each container's readings: mean, median, trimmed_mean or max
+AGGREGATION_FUNCTION = os.getenv("AGGREGATION_FUNCTION", "mean")
+AGGREGATION_TRIM = float(os.getenv("AGGREGATION_TRIM", "0.1"))  # fraction cut at each end by trimmed_mean
+window_function = get_window_function(AGGREGATION_FUNCTION, AGGREGATION_TRIM)
+AGGREGATION_WINDOW = int(os.getenv("AGGREGATION_WINDOW", "60"))  # seconds, windows aligned to the clock
+AGGREGATION_ALLOWED_LATENESS = int(os.getenv("AGGREGATION_ALLOWED_LATENESS", "10"))  # wait before closing a window
+AGGREGATION_COUNT_TRIGGER = int(os.getenv("AGGREGATION_COUNT_TRIGGER", "0"))  # samples that flush a container early, 0 = off
+RAW_RETENTION_HOURS = int(os.getenv("RAW_RETENTION_HOURS", "24"))
+RAW_CLEANUP_INTERVAL = int(os.getenv("RAW_CLEANUP_INTERVAL", "600"))  # seconds
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.001"))  # fraction of /push packets traced to the server
+TRACE_MAX_PENDING = int(os.getenv("TRACE_MAX_PENDING", "1000"))  # traces waiting for aggregation or upload
 
 # --- Database setup ---
-DATABASE_URL = "sqlite:////db/data.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:////db/data.db")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # NORMAL is durable across app crashes in WAL mode
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "32768"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "5000"))
+PUSH_QUEUE_MAX = int(os.getenv("PUSH_QUEUE_MAX", "100000"))  # buffered measurements before /push answers 503
+PUSH_WRITE_BATCH = int(os.getenv("PUSH_WRITE_BATCH", "5000"))  # measurements per write transaction
+
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets /push write while the aggregation thread reads;
+    # busy_timeout makes writers wait for each other instead of failing with "database is locked"
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 from sqlalchemy.orm import declarative_base
 Base = declarative_base()
@@ -54,6 +112,15 @@ class LevelData(Base):
     is_sent = Column(Boolean, default=False)
     fill_level = Column(Float)
     created_at = Column(TIMESTAMP, default=func.now())
+    # Failed uploads: the server may have kept such a batch, so compaction
+    # must not change it. Rejected ones count towards the dead letter.
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    rejections = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        # Unsent backlog, oldest first
+        Index("ix_level_data_is_sent_id", "is_sent", "id"),
+    )
 
 class RawSensorData(Base):
     __tablename__ = "raw_sensor_data"
@@ -65,11 +132,166 @@ class RawSensorData(Base):
     fill_level = Column(Float)
     received_at = Column(TIMESTAMP, default=func.now())
 
+    __table_args__ = (
+        # Pending readings per container in a window (aggregation and level_id update)
+        Index("ix_raw_sensor_data_level_container_ts", "level_id", "container_id", "timestamp"),
+        # Retention cleanup
+        Index("ix_raw_sensor_data_timestamp", "timestamp"),
+    )
+
 Base.metadata.create_all(bind=engine)
+# create_all skips columns and indexes of tables that already exist
+with engine.begin() as connection:
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                connection.exec_driver_sql(
+                    f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=engine.dialect)}"
+                )
+for table in Base.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
 logger.info("Database and tables created.")
 
+# --- Ingest queue and writer ---
+push_queue = IngestQueue(PUSH_QUEUE_MAX)
+
+# --- Metrics and sampled tracing ---
+Counter("sced_edge_measurements_accepted_total", "Measurements queued by /push", collect=lambda: push_queue.accepted)
+Counter("sced_edge_measurements_rejected_total", "Measurements refused with 503", collect=lambda: push_queue.rejected)
+Counter("sced_edge_measurements_dropped_total", "Queued measurements lost to write errors", collect=lambda: push_queue.dropped)
+Gauge("sced_edge_queue_depth", "Measurements waiting to be written", collect=lambda: push_queue.measurements)
+write_seconds = Histogram("sced_edge_write_seconds", "Time to store one batch of queued packets")
+write_batch_size = Histogram("sced_edge_write_batch_size", "Measurements per write transaction", buckets=SIZE_BUCKETS)
+aggregation_cycle_seconds = Histogram("sced_edge_aggregation_cycle_seconds", "Duration of each window close")
+levels_total = Counter("sced_edge_levels_total", "Levels produced by aggregation")
+Gauge("sced_edge_outbox_pending", "Levels not yet sent to the central server", collect=lambda: outbox_stats["pending"])
+Gauge("sced_edge_outbox_dead_letters", "Levels no longer sent after OUTBOX_MAX_REJECTIONS rejections",
+      collect=lambda: outbox_stats["dead_letters"])
+Counter("sced_edge_levels_sent_total", "Levels accepted by the central server", collect=lambda: outbox_stats["sent"])
+Counter("sced_edge_levels_compacted_total", "Unsent levels merged to bound the outbox",
+        collect=lambda: outbox_stats["compacted"])
+
+# (container_id, window index) -> trace of a packet waiting for its window to close
+window_traces: dict[tuple[str, int], dict] = {}
+# LevelData id -> trace, until the level is sent
+level_traces: dict[int, dict] = {}
+trace_lock = threading.Lock()
+
+def trace_packet(packet):
+    """Follow one packet: the level of its window carries the trace up to the server."""
+    local = datetime.fromtimestamp(packet.measurements[-1].timestamp, TZ).replace(tzinfo=None)
+    key = (packet.container_id, int((local - EPOCH).total_seconds()) // AGGREGATION_WINDOW)
+    with trace_lock:
+        if len(window_traces) < TRACE_MAX_PENDING and key not in window_traces:
+            window_traces[key] = start_trace()
+            logger.debug(f"Tracing {packet.sensor_id} as {window_traces[key]['id']}")
+# sensor_id -> container_id of registered sensors; only touched by the writer thread
+known_sensors: dict[str, str] = {}
+
+def register_sensors(db, sensors: dict[str, str]) -> dict[str, str]:
+    """Return the container of each sensor, creating unknown sensors and their containers."""
+    containers = dict(db.query(Sensor.id, Sensor.container_id).filter(Sensor.id.in_(sensors)).all())
+    new = {sensor_id: container_id for sensor_id, container_id in sensors.items() if sensor_id not in containers}
+    if new:
+        logger.info(f"Sensors {sorted(new)} not found. Creating new sensors and containers.")
+        existing = {c for (c,) in db.query(Container.id).filter(Container.id.in_(set(new.values()))).all()}
+        db.add_all(Container(id=c, type="generic") for c in set(new.values()) - existing)
+        db.add_all(
+            Sensor(id=sensor_id, container_id=container_id, installed_at=datetime.now(TZ))
+            for sensor_id, container_id in new.items()
+        )
+        containers.update(new)
+    return containers
+
+def write_packets(packets: list) -> int:
+    """Store a batch of queued packets in one transaction. Runs in a worker thread."""
+    db = SessionLocal()
+    try:
+        unknown = {p.sensor_id: p.container_id for p in packets if p.sensor_id not in known_sensors}
+        registered = register_sensors(db, unknown) if unknown else {}
+        containers = {**known_sensors, **registered}
+        rows = [
+            {
+                "sensor_id": p.sensor_id,
+                "container_id": containers[p.sensor_id],
+                "timestamp": datetime.fromtimestamp(m.timestamp, TZ),
+                "fill_level": m.fill_level,
+            }
+            for p in packets for m in p.measurements
+        ]
+        if rows:
+            db.execute(insert(RawSensorData.__table__), rows)
+        db.commit()
+        known_sensors.update(registered)
+        if AGGREGATION_COUNT_TRIGGER:
+            count_samples(rows)
+        return len(rows)
+    finally:
+        db.close()
+
+async def write_loop():
+    while await push_queue.wait():
+        batch = push_queue.take(PUSH_WRITE_BATCH)
+        started = time.monotonic()
+        try:
+            written = await asyncio.to_thread(write_packets, [packet for packet, _ in batch])
+            push_queue.record_written(written, time.monotonic() - started)
+            write_seconds.observe(time.monotonic() - started)
+            write_batch_size.observe(written)
+        except OperationalError as e:
+            # Typically the database being locked or the disk busy: keep the data and retry
+            logger.error(f"Error storing measurements, retrying: {e}")
+            push_queue.requeue(batch)
+            await asyncio.sleep(1)
+        except Exception as e:
+            push_queue.dropped += sum(size for _, size in batch)
+            logger.error(f"Error storing {len(batch)} packets, dropped: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    writer = asyncio.create_task(write_loop())
+    yield
+    # Flush what is still queued before exiting
+    push_queue.close()
+    await writer
+
+# --- Binary sensor packets ---
+class WireRequest(Request):
+    """
+    /push body in the binary wire format. FastAPI only parses JSON bodies, so
+    the request advertises application/json and json() returns the decoded packet.
+    """
+
+    def __init__(self, request: Request):
+        headers = [(k, v) for k, v in request.scope["headers"] if k != b"content-type"]
+        headers.append((b"content-type", b"application/json"))
+        super().__init__({**request.scope, "headers": headers}, request.receive)
+
+    async def json(self):
+        if not hasattr(self, "_json"):
+            try:
+                self._json = wire.decode_packet(await self.body())
+            except wire.WireError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid binary body: {e}")
+        return self._json
+
+class WireRoute(APIRoute):
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            if wire.is_wire(request.headers.get("Content-Type")):
+                request = WireRequest(request)
+            return await original_route_handler(request)
+
+        return route_handler
+
 # --- FastAPI setup ---
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = WireRoute
+instrument(app)
 logger.info("FastAPI app initialized.")
 
 # --- Pydantic Input Model ---
@@ -82,101 +304,389 @@ class SensorPacket(BaseModel):
     sensor_id: str
     measurements: List[Measurement]
 
-@app.post("/push")
+@app.post("/push", status_code=202)
 async def push_data(packet: SensorPacket):
-    logger.info(f"Received data from sensor {packet.sensor_id} with {len(packet.measurements)} measurements.")
-    db = SessionLocal()
-    try:
-        # Ensure sensor and container exist
-        sensor = db.query(Sensor).filter(Sensor.id == packet.sensor_id).first()
-        if not sensor:
-            logger.info(f"Sensor {packet.sensor_id} not found. Creating new sensor and container.")
-            if not db.query(Container).filter_by(id=packet.container_id).first():
-                db.add(Container(id=packet.container_id, type="generic"))
-            sensor = Sensor(id=packet.sensor_id, container_id=packet.container_id, installed_at=datetime.now(TZ))
-            db.add(sensor)
-            db.commit()
-        for m in packet.measurements:
-            db.add(RawSensorData(
-                sensor_id=packet.sensor_id,
-                container_id=sensor.container_id,
-                timestamp=datetime.fromtimestamp(m.timestamp, TZ),
-                fill_level=m.fill_level
+    if len(packet.measurements) > push_queue.max_measurements:
+        # Would not fit even into an empty queue, retrying cannot help
+        raise HTTPException(status_code=413, detail=f"At most {PUSH_QUEUE_MAX} measurements per packet")
+    if not push_queue.put(packet, len(packet.measurements)):
+        raise HTTPException(status_code=503, detail="Ingest queue full, retry later", headers={"Retry-After": "1"})
+    if packet.measurements and sampled(TRACE_SAMPLE_RATE):
+        trace_packet(packet)
+    return {"status": "queued"}
+
+@app.get("/stats")
+def get_stats():
+    return {"queue": push_queue.stats(), "aggregation": scheduler_stats, "outbox": outbox_stats}
+
+# --- Aggregation engine ---
+# Window functions SQLite computes directly in the grouped query
+SQL_WINDOW_FUNCTIONS = {"mean": func.avg, "max": func.max}
+# Timestamps are stored as naive local time; windows are aligned on them
+EPOCH = datetime(1970, 1, 1)
+
+def local_now() -> datetime:
+    return datetime.now(TZ).replace(tzinfo=None)
+
+def window_start(ts: datetime) -> datetime:
+    return ts - timedelta(seconds=(ts - EPOCH).total_seconds() % AGGREGATION_WINDOW)
+
+def aggregate_pending(db, until: datetime, containers=None) -> list:
+    """
+    Aggregate every not yet aggregated reading older than `until` into one
+    LevelData per container and aligned window, with a single query, and
+    link the raw rows to it, all in one transaction. Levels of windows that
+    ended by `until` are stamped with the window end, those of a still open
+    window (count trigger) with their last reading.
+    """
+    window = cast(func.strftime("%s", RawSensorData.timestamp), Integer) // AGGREGATION_WINDOW
+    pending = [RawSensorData.level_id.is_(None), RawSensorData.timestamp < until]
+    if containers is not None:
+        pending.append(RawSensorData.container_id.in_(containers))
+    if AGGREGATION_FUNCTION in SQL_WINDOW_FUNCTIONS:
+        groups = db.query(
+            RawSensorData.container_id,
+            window,
+            SQL_WINDOW_FUNCTIONS[AGGREGATION_FUNCTION](RawSensorData.fill_level),
+            func.max(RawSensorData.id),
+            func.max(RawSensorData.timestamp),
+        ).filter(*pending).group_by(RawSensorData.container_id, window).all()
+    else:
+        rows = db.query(
+            RawSensorData.container_id, window, RawSensorData.fill_level,
+            RawSensorData.id, RawSensorData.timestamp
+        ).filter(*pending).order_by(RawSensorData.container_id, window, RawSensorData.fill_level).all()
+        groups = []
+        for (container_id, index), group in groupby(rows, key=itemgetter(0, 1)):
+            group = list(group)
+            groups.append((
+                container_id, index, window_function([r[2] for r in group]),
+                max(r[3] for r in group), max(r[4] for r in group)
             ))
-        db.commit()
-        logger.info("Measurements stored successfully.")
-    except Exception as e:
-        logger.error(f"Error processing data from sensor {packet.sensor_id}: {e}")
-    finally:
-        db.close()
-    return {"status": "ok"}
 
-# --- Background aggregation and sending task ---
-def aggregate_and_send():
-    logger.info("Background aggregation task started.")
+    if not groups:
+        return []
+
+    levels = []
+    updates = []
+    for container_id, index, value, max_id, last_timestamp in groups:
+        start = EPOCH + timedelta(seconds=index * AGGREGATION_WINDOW)
+        end = start + timedelta(seconds=AGGREGATION_WINDOW)
+        level = LevelData(
+            container_id=container_id,
+            timestamp=end if end <= until else last_timestamp,
+            fill_level=round(value, 2)
+        )
+        levels.append(level)
+        updates.append({"b_container_id": container_id, "b_start": start, "b_end": end, "b_max_id": max_id})
+    db.add_all(levels)
+    db.flush()  # assigns LevelData ids
+
+    # One executemany for all groups; max_id leaves out rows pushed after the query above
+    raw = RawSensorData.__table__
+    db.execute(
+        update(raw).where(
+            raw.c.container_id == bindparam("b_container_id"),
+            raw.c.level_id.is_(None),
+            raw.c.timestamp >= bindparam("b_start"),
+            raw.c.timestamp < bindparam("b_end"),
+            raw.c.id <= bindparam("b_max_id"),
+        ).values(level_id=bindparam("b_level_id")),
+        [dict(u, b_level_id=level.id) for level, u in zip(levels, updates)]
+    )
+    db.commit()
+    levels_total.inc(len(levels))
+    if window_traces:
+        with trace_lock:
+            for level, (container_id, index, *_) in zip(levels, groups):
+                trace = window_traces.pop((container_id, index), None)
+                if trace is not None and len(level_traces) < TRACE_MAX_PENDING:
+                    level_traces[level.id] = mark(trace)
+    logger.debug(f"Aggregated {len(levels)} level records.")
+    return levels
+
+# --- Aggregation scheduler ---
+# Set by the writer when a container reaches AGGREGATION_COUNT_TRIGGER samples
+aggregation_wake = threading.Event()
+sample_counts: dict[str, int] = {}
+triggered_containers: set[str] = set()
+trigger_lock = threading.Lock()
+scheduler_stats = {
+    "window_seconds": AGGREGATION_WINDOW,
+    "windows_closed": 0,
+    "windows_skipped": 0,  # window closes missed because a cycle overran
+    "count_triggers": 0,
+    "late_levels": 0,  # levels for windows that had already been closed
+    "last_window_end": None,
+    "last_cycle_ms": 0.0,
+    "lag_seconds": 0.0,  # window end to its levels being stored
+}
+
+def count_samples(rows: list[dict]):
+    with trigger_lock:
+        for row in rows:
+            container_id = row["container_id"]
+            sample_counts[container_id] = sample_counts.get(container_id, 0) + 1
+            if sample_counts[container_id] >= AGGREGATION_COUNT_TRIGGER:
+                triggered_containers.add(container_id)
+        if triggered_containers:
+            aggregation_wake.set()
+
+def aggregation_scheduler():
+    """
+    Close tumbling windows of AGGREGATION_WINDOW seconds, aligned to the
+    clock, once AGGREGATION_ALLOWED_LATENESS has passed after their end
+    (the watermark). Readings arriving after their window closed are
+    aggregated at the next close as late levels of that window.
+    """
+    logger.info("Aggregation scheduler started.")
+    lateness = timedelta(seconds=AGGREGATION_ALLOWED_LATENESS)
+    width = timedelta(seconds=AGGREGATION_WINDOW)
+    closed_until = None
+    next_close = window_start(local_now()) + width + lateness
+    next_cleanup = time.monotonic()
     while True:
+        aggregation_wake.wait(max(0.0, (next_close - local_now()).total_seconds()))
+        aggregation_wake.clear()
         db = SessionLocal()
         try:
-            # Remove data older than 24h
-            cutoff = datetime.now(TZ) - timedelta(hours=24)
-            deleted = db.query(RawSensorData).filter(RawSensorData.timestamp < cutoff).delete()
-            if deleted:
-                logger.info(f"Deleted {deleted} old raw data records.")
+            with trigger_lock:
+                containers = set(triggered_containers)
+                triggered_containers.clear()
+                for container_id in containers:
+                    sample_counts.pop(container_id, None)
+            if containers:
+                scheduler_stats["count_triggers"] += len(containers)
+                if aggregate_pending(db, local_now(), containers):
+                    outbox_wake.set()
+
+            now = local_now()
+            if now >= next_close:
+                started = time.monotonic()
+                # Every window ended before the watermark closes now
+                until = window_start(now - lateness)
+                with trigger_lock:
+                    sample_counts.clear()
+                levels = aggregate_pending(db, until)
+                if levels:
+                    outbox_wake.set()
+                if closed_until is not None:
+                    scheduler_stats["late_levels"] += sum(1 for level in levels if level.timestamp <= closed_until)
+                scheduler_stats["windows_skipped"] += int((until - (next_close - lateness)) / width)
+                scheduler_stats["windows_closed"] += 1
+                scheduler_stats["last_window_end"] = until.isoformat()
+                scheduler_stats["last_cycle_ms"] = round((time.monotonic() - started) * 1000, 1)
+                aggregation_cycle_seconds.observe(time.monotonic() - started)
+                scheduler_stats["lag_seconds"] = round((local_now() - until).total_seconds(), 1)
+                closed_until = until
+                next_close = until + width + lateness
+
+            if time.monotonic() >= next_cleanup:
+                cutoff = local_now() - timedelta(hours=RAW_RETENTION_HOURS)
+                deleted = delete_in_batches(db, RawSensorData.__table__, RawSensorData.timestamp < cutoff)
+                if deleted:
+                    logger.info(f"Deleted {deleted} old raw data records.")
+                next_cleanup = time.monotonic() + RAW_CLEANUP_INTERVAL
+        except Exception as e:
+            logger.error(f"Error in aggregation: {e}")
+            time.sleep(1)
+        finally:
+            db.close()
+
+# --- Outbox: unsent LevelData forwarded to the central server ---
+uplink = Uplink(CENTRAL_SERVER_BATCH_URL, max_inflight=UPLINK_MAX_INFLIGHT,
+                max_retries=UPLINK_MAX_RETRIES, timeout=UPLINK_TIMEOUT, wire_format=UPLINK_FORMAT)
+drain_limiter = RateLimiter(OUTBOX_DRAIN_RATE, burst=UPLINK_BATCH_SIZE * UPLINK_MAX_INFLIGHT)
+outbox_stats = {"pending": 0, "dead_letters": 0, "sent": 0, "compacted": 0, "purged": 0}
+# Set when new levels are stored, so they are sent right away
+outbox_wake = threading.Event()
+
+def count_pending(db) -> int:
+    return db.query(func.count(LevelData.id)).filter(
+        LevelData.is_sent.is_(False), LevelData.rejections < OUTBOX_MAX_REJECTIONS
+    ).scalar()
+
+def count_dead_letters(db) -> int:
+    """Unsent levels the server rejected OUTBOX_MAX_REJECTIONS times; kept for troubleshooting."""
+    return db.query(func.count(LevelData.id)).filter(
+        LevelData.is_sent.is_(False), LevelData.rejections >= OUTBOX_MAX_REJECTIONS
+    ).scalar()
+
+def level_payload(entry) -> dict:
+    payload = {
+        "node_id": NODE_ID,
+        "container_id": entry.container_id,
+        "timestamp": entry.timestamp.isoformat(),
+        "fill_level": entry.fill_level,
+        "created_at": entry.created_at.isoformat()
+    }
+    trace = level_traces.get(entry.id)
+    if trace is not None:
+        payload["trace"] = mark(trace)
+    return payload
+
+def send_pending(db) -> int:
+    """
+    Upload unsent LevelData oldest first in chunks of UPLINK_MAX_INFLIGHT
+    batches, paced by OUTBOX_DRAIN_RATE, until the backlog is empty or the
+    server is unreachable. Levels of a batch rejected OUTBOX_MAX_REJECTIONS
+    times become dead letters and are no longer sent.
+    """
+    sent = 0
+    last_id = 0
+    while True:
+        rows = db.query(
+            LevelData.id, LevelData.container_id, LevelData.timestamp,
+            LevelData.fill_level, LevelData.created_at
+        ).filter(
+            LevelData.is_sent.is_(False), LevelData.rejections < OUTBOX_MAX_REJECTIONS, LevelData.id > last_id
+        ).order_by(LevelData.id).limit(UPLINK_BATCH_SIZE * UPLINK_MAX_INFLIGHT).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        drain_limiter.acquire(len(rows))
+
+        chunks = [rows[i:i + UPLINK_BATCH_SIZE] for i in range(0, len(rows), UPLINK_BATCH_SIZE)]
+        results = uplink.send_batches([
+            (batch_key(NODE_ID, chunk), [level_payload(entry) for entry in chunk])
+            for chunk in chunks
+        ])
+
+        sent_ids = [entry.id for chunk, ok in zip(chunks, results) if ok for entry in chunk]
+        if sent_ids and level_traces:
+            with trace_lock:
+                for level_id in sent_ids:
+                    level_traces.pop(level_id, None)
+        if sent_ids:
+            db.query(LevelData).filter(LevelData.id.in_(sent_ids)).update(
+                {LevelData.is_sent: True}, synchronize_session=False
+            )
+            db.commit()
+            sent += len(sent_ids)
+        failed_ids = [entry.id for chunk, ok in zip(chunks, results) if not ok for entry in chunk]
+        rejected_ids = [entry.id for chunk, ok in zip(chunks, results) if ok is False for entry in chunk]
+        if failed_ids:
+            db.query(LevelData).filter(LevelData.id.in_(failed_ids)).update(
+                {LevelData.attempts: LevelData.attempts + 1}, synchronize_session=False
+            )
+        if rejected_ids:
+            db.query(LevelData).filter(LevelData.id.in_(rejected_ids)).update(
+                {LevelData.rejections: LevelData.rejections + 1}, synchronize_session=False
+            )
+            dead = db.query(func.count(LevelData.id)).filter(
+                LevelData.id.in_(rejected_ids), LevelData.rejections >= OUTBOX_MAX_REJECTIONS
+            ).scalar()
+            if dead:
+                logger.error(f"{dead} levels rejected {OUTBOX_MAX_REJECTIONS} times, moved to dead letters.")
+        if failed_ids:
             db.commit()
+        if None in results:
+            # Central server unreachable, the rest waits for the next cycle
+            break
+    if sent:
+        logger.info(f"Sent {sent} level records to central server.")
+    return sent
 
-            containers = db.query(Container).all()
-            now = datetime.now(TZ)
-            window_start = now - timedelta(seconds=30)
-
-            for container in containers:
-                data = db.query(RawSensorData).filter(
-                    RawSensorData.container_id == container.id,
-                    RawSensorData.timestamp >= window_start,
-                    RawSensorData.timestamp <= now
-                ).all()
-
-                if data:
-                    avg_fill = sum(d.fill_level for d in data) / len(data)
-                    level_data = LevelData(
-                        container_id=container.id,
-                        timestamp=now,
-                        fill_level=round(avg_fill, 2)
-                    )
-                    db.add(level_data)
-                    db.commit()
-
-                    for d in data:
-                        d.level_id = level_data.id
-                    db.commit()
-                    logger.info(f"Aggregated level data stored for container {container.id}.")
-
-            # Send unsent data
-            unsent = db.query(LevelData).filter_by(is_sent=False).all()
-            for entry in unsent:
-                try:
-                    payload = {
-                        "node_id": NODE_ID,
-                        "container_id": entry.container_id,
-                        "timestamp": entry.timestamp.isoformat(),
-                        "fill_level": entry.fill_level,
-                        "created_at": entry.created_at.isoformat()
-                    }
-                    response = requests.post(CENTRAL_SERVER_URL, json=payload, timeout=5)
-                    if response.status_code == 200:
-                        entry.is_sent = True
-                        db.commit()
-                        logger.info(f"Sent data for container {entry.container_id} to central server.")
-                    else:
-                        logger.warning(f"Failed to send data for container {entry.container_id}, status code {response.status_code}.")
-                except Exception as e:
-                    logger.error(f"Failed to send data for container {entry.container_id}: {e}")
+COMPACT_BUCKET_MAX = 86400
+
+def compact_outbox(db) -> int:
+    """
+    Keep the unsent backlog under OUTBOX_MAX_PENDING rows by merging the
+    oldest levels of each container into one per OUTBOX_COMPACT_BUCKET
+    seconds (their mean, at the newest timestamp). The bucket widens 4x,
+    up to a day, while the backlog is still over budget. Levels whose upload
+    already failed keep their batch as sent, so they are left alone. Returns
+    rows removed.
+    """
+    if OUTBOX_MAX_PENDING <= 0:
+        return 0
+    pending = count_pending(db)
+    level = LevelData.__table__
+    raw = RawSensorData.__table__
+    bucket = OUTBOX_COMPACT_BUCKET
+    last_id = 0
+    removed = 0
+    while pending > OUTBOX_MAX_PENDING and bucket <= COMPACT_BUCKET_MAX:
+        rows = db.query(
+            LevelData.id, LevelData.container_id, LevelData.timestamp, LevelData.fill_level
+        ).filter(
+            LevelData.is_sent.is_(False), LevelData.attempts == 0, LevelData.id > last_id
+        ).order_by(LevelData.id).limit(OUTBOX_COMPACT_CHUNK).all()
+        if not rows:
+            # Whole backlog merged at this width
+            bucket *= 4
+            last_id = 0
+            continue
+        last_id = rows[-1].id
+
+        groups = {}
+        for row in rows:
+            key = (row.container_id, int((row.timestamp - EPOCH).total_seconds() // bucket))
+            groups.setdefault(key, []).append(row)
+        kept = []
+        merged = []
+        for group in groups.values():
+            if len(group) < 2:
+                continue
+            group.sort(key=lambda r: r.timestamp)
+            keep = group[-1]
+            kept.append({"b_id": keep.id, "b_fill_level": round(sum(r.fill_level for r in group) / len(group), 2)})
+            merged.extend({"b_old": r.id, "b_new": keep.id} for r in group[:-1])
+        if not merged:
+            continue
+
+        db.execute(update(level).where(level.c.id == bindparam("b_id")).values(fill_level=bindparam("b_fill_level")), kept)
+        db.execute(update(raw).where(raw.c.level_id == bindparam("b_old")).values(level_id=bindparam("b_new")), merged)
+        db.execute(delete(level).where(level.c.id == bindparam("b_old")), merged)
+        db.commit()
+        pending -= len(merged)
+        removed += len(merged)
+        if level_traces:
+            with trace_lock:
+                for entry in merged:
+                    level_traces.pop(entry["b_old"], None)
+
+    if removed:
+        logger.warning(f"Outbox over budget: merged {removed} unsent levels, {pending} pending.")
+    elif pending > OUTBOX_MAX_PENDING:
+        logger.warning(f"Outbox over budget with {pending} pending levels and nothing left to merge.")
+    return removed
+
+def outbox_loop():
+    logger.info("Outbox task started.")
+    while True:
+        db = SessionLocal()
+        try:
+            outbox_stats["compacted"] += compact_outbox(db)
+            outbox_stats["sent"] += send_pending(db)
+            # Sent levels are only kept for troubleshooting
+            cutoff = datetime.now(TZ) - timedelta(hours=OUTBOX_SENT_RETENTION_HOURS)
+            outbox_stats["purged"] += delete_in_batches(
+                db, LevelData.__table__, LevelData.is_sent.is_(True), LevelData.timestamp < cutoff
+            )
+            outbox_stats["pending"] = count_pending(db)
+            outbox_stats["dead_letters"] = count_dead_letters(db)
         except Exception as e:
-            logger.error(f"Error in aggregation/send: {e}")
+            logger.error(f"Error in outbox: {e}")
         finally:
             db.close()
 
-        time.sleep(60)  # Every 5 minutes
+        outbox_wake.wait(OUTBOX_POLL_INTERVAL)
+        outbox_wake.clear()
+
+# --- Retention ---
+def delete_in_batches(db, table, *conditions) -> int:
+    """Delete matching rows in small transactions, so /push never waits long for the lock."""
+    deleted = 0
+    while True:
+        batch = select(table.c.id).where(*conditions).limit(CLEANUP_BATCH_SIZE)
+        result = db.execute(delete(table).where(table.c.id.in_(batch)))
+        db.commit()
+        deleted += result.rowcount
+        if result.rowcount < CLEANUP_BATCH_SIZE:
+            return deleted
 
-# --- Start background thread ---
-threading.Thread(target=aggregate_and_send, daemon=True).start()
+# --- Start background threads ---
+threading.Thread(target=aggregation_scheduler, name="aggregation", daemon=True).start()
+threading.Thread(target=outbox_loop, name="outbox", daemon=True).start()
 logger.info("Processing node is running.")
@@ -0,0 +1,163 @@
+"""
+Uplink: sends aggregated levels to the central server in gzip-compressed
+batches over a persistent HTTP session.
+
+Each batch carries an Idempotency-Key derived from its LevelData rows, so a
+batch retried after a lost response is not published twice by the ingestor.
+Batches go as JSON or, with wire_format="binary", in the compact layout of
+wire.py.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+import wire
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Worth retrying; any other error status means the server rejected the batch
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+batch_seconds = Histogram(
+    "sced_uplink_batch_seconds", "Time to deliver one batch, retries included, by result", ("result",)
+)
+batch_bytes = Histogram(
+    "sced_uplink_batch_bytes", "Compressed size of each batch", buckets=(1024, 4096, 16384, 65536, 262144, 1048576)
+)
+
+class UplinkUnavailable(Exception):
+    pass
+
+class RateLimiter:
+    """Token bucket: on average `rate` items per second, bursts up to `burst`."""
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n: int = 1):
+        """Take n tokens, sleeping as long as needed. Requests above burst go into debt."""
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+def batch_key(node_id: str, levels: list) -> str:
+    """
+    Key of a batch of LevelData rows. SQLite reuses ids once sent rows are
+    purged, so their creation and reading times are hashed along with them.
+    """
+    parts = [f"{level.id}|{level.container_id}|{level.timestamp.isoformat()}|{level.created_at.isoformat()}"
+             for level in levels]
+    digest = hashlib.sha256(",".join(parts).encode()).hexdigest()[:32]
+    return f"{node_id}:{digest}"
+
+class Uplink:
+    def __init__(self, url: str, max_inflight: int = 2, max_retries: int = 5,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0, timeout: float = 10.0,
+                 wire_format: str = "json"):
+        self.url = url
+        self.wire_format = wire_format
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.max_inflight = max_inflight
+        # Keep-alive connections, one per concurrent batch
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_inflight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="uplink")
+
+    def _backoff(self, attempt: int, retry_after: str | None = None) -> float:
+        # Full jitter, so nodes coming back from the same outage do not retry in lockstep
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    def _encode(self, readings: list[dict]) -> tuple[bytes, str]:
+        if self.wire_format == "binary":
+            try:
+                return gzip.compress(wire.encode_readings(readings)), wire.CONTENT_TYPE
+            except wire.WireError as e:
+                # e.g. a compacted batch spanning too long a period: JSON has no such limits
+                logger.warning(f"Sending batch as JSON: {e}")
+        return gzip.compress(json.dumps(readings, separators=(",", ":")).encode()), "application/json"
+
+    def send_batch(self, key: str, readings: list[dict]) -> bool:
+        """
+        POST one batch. True if accepted, False if the server rejected it;
+        raises UplinkUnavailable once retries are exhausted.
+        """
+        body, content_type = self._encode(readings)
+        batch_bytes.observe(len(body))
+        started = time.perf_counter()
+        result = "unavailable"
+        try:
+            sent = self._post(key, body, content_type)
+            result = "sent" if sent else "rejected"
+            return sent
+        finally:
+            batch_seconds.observe(time.perf_counter() - started, result)
+
+    def _post(self, key: str, body: bytes, content_type: str) -> bool:
+        headers = {
+            "Content-Type": content_type,
+            "Content-Encoding": "gzip",
+            "Idempotency-Key": key,
+        }
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+                if response.status_code < 300:
+                    return True
+                if response.status_code not in RETRY_STATUS:
+                    logger.warning(f"Batch {key} rejected with status {response.status_code}: {response.text[:200]}")
+                    return False
+                retry_after = response.headers.get("Retry-After")
+                error = f"status {response.status_code}"
+            except requests.RequestException as e:
+                error = str(e)
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt, retry_after)
+                logger.warning(f"Batch {key} failed ({error}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+        raise UplinkUnavailable(f"Batch {key} not delivered after {self.max_retries + 1} attempts: {error}")
+
+    def send_batches(self, batches: list[tuple[str, list[dict]]]) -> list[bool | None]:
+        """
+        Send (key, readings) batches with at most max_inflight in flight.
+        Per batch: True sent, False rejected, None server unreachable.
+        """
+        futures = [self.executor.submit(self.send_batch, key, readings) for key, readings in batches]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except UplinkUnavailable as e:
+                logger.error(str(e))
+                results.append(None)
+        return results
@@ -0,0 +1,351 @@
+"""
+Load generator: drives many simulated sensors from one process.
+
+Each sensor behaves like sensor_simulator.py (same /push packets, buffer of
+unsent measurements) but runs as an asyncio task over a shared HTTP
+connection pool. Fill levels follow per-container curves: gradual filling
+with noise, occasional echo spikes and emptying events.
+
+    python loadgen.py --target push --url http://localhost:5000 --sensors 5000 --interval 3 --duration 120
+    python loadgen.py --target report --url http://localhost:8000 --sensors 20000 --profile burst
+    python loadgen.py --target mqtt --mqtt-host localhost --sensors 10000 --outage-at 30 --outage-for 60
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import signal
+import statistics
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime
+import httpx
+
+# --- Fill level model ---
+class FillCurve:
+    """Fill level of one container over simulated time."""
+
+    def __init__(self, rng: random.Random, time_scale: float):
+        self.rng = rng
+        self.time_scale = time_scale
+        self.level = rng.uniform(0, 30)
+        self.rate = rng.uniform(2, 12)  # % per simulated hour
+        self.empty_at = rng.uniform(80, 95)
+        self.updated = time.monotonic()
+
+    def sample(self, noise: float, spike_rate: float) -> float:
+        now = time.monotonic()
+        hours = (now - self.updated) * self.time_scale / 3600
+        self.updated = now
+        self.level += self.rate * hours
+        # Collected when nearly full, now and then earlier
+        if self.level >= self.empty_at or self.rng.random() < 0.02 * hours:
+            self.level = self.rng.uniform(0, 5)
+            self.empty_at = self.rng.uniform(80, 95)
+        reading = self.level + self.rng.gauss(0, noise)
+        if self.rng.random() < spike_rate:
+            # Ultrasonic echo off the lid or a bag
+            reading = self.rng.choice([self.rng.uniform(0, 10), self.rng.uniform(95, 100)])
+        return round(min(100.0, max(0.0, reading)), 1)
+
+# --- Stats ---
+class LatencyStats:
+    def __init__(self, reservoir: int = 100_000, seed: int = 0):
+        self.window = []
+        self.reservoir = []
+        self.reservoir_size = reservoir
+        self.rng = random.Random(seed)
+        self.seen = 0
+        self.requests = 0
+        self.measurements = 0
+        self.statuses = Counter()
+        self.window_started = time.monotonic()
+        self.window_requests = 0
+        self.window_measurements = 0
+
+    def record(self, latency_ms: float, status, measurements: int):
+        self.requests += 1
+        self.window_requests += 1
+        self.statuses[str(status)] += 1
+        if isinstance(status, int) and status < 300:
+            self.measurements += measurements
+            self.window_measurements += measurements
+        self.window.append(latency_ms)
+        # Reservoir sample for the whole-run percentiles
+        self.seen += 1
+        if len(self.reservoir) < self.reservoir_size:
+            self.reservoir.append(latency_ms)
+        else:
+            i = self.rng.randrange(self.seen)
+            if i < self.reservoir_size:
+                self.reservoir[i] = latency_ms
+
+    def take_window(self) -> dict:
+        now = time.monotonic()
+        elapsed = max(now - self.window_started, 1e-9)
+        summary = {
+            "rps": round(self.window_requests / elapsed, 1),
+            "mps": round(self.window_measurements / elapsed, 1),
+            **percentiles(self.window),
+        }
+        self.window = []
+        self.window_started = now
+        self.window_requests = 0
+        self.window_measurements = 0
+        return summary
+
+def percentiles(values: list[float]) -> dict:
+    if len(values) < 2:
+        value = round(values[0], 1) if values else None
+        return {"p50_ms": value, "p95_ms": value, "p99_ms": value}
+    q = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50_ms": round(q[49], 1), "p95_ms": round(q[94], 1), "p99_ms": round(q[98], 1)}
+
+# --- Targets ---
+class HttpTarget:
+    def __init__(self, args):
+        self.args = args
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        self.client = httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout)
+
+    async def send(self, sensor, measurements: list[tuple[float, int]]) -> int:
+        if self.args.target == "push":
+            response = await self.client.post("/push", json={
+                "sensor_id": sensor.sensor_id,
+                "container_id": sensor.container_id,
+                "measurements": [{"fill_level": level, "timestamp": ts} for level, ts in measurements],
+            })
+            return response.status_code
+        reports = [
+            {
+                "node_id": self.args.node_id,
+                "container_id": sensor.container_id,
+                "fill_level": level,
+                "timestamp": datetime.fromtimestamp(ts).isoformat(),
+                "created_at": datetime.now().isoformat(),
+            }
+            for level, ts in measurements
+        ]
+        if len(reports) == 1:
+            response = await self.client.post("/api/report", json=reports[0])
+        else:
+            response = await self.client.post("/api/report/batch", json=reports)
+        return response.status_code
+
+    async def close(self):
+        await self.client.aclose()
+
+class MqttTarget:
+    """Publishes worker-format messages straight to the broker; latency is the QoS 1 PUBACK time."""
+
+    def __init__(self, args):
+        import paho.mqtt.client as mqtt  # only needed for this target
+
+        self.args = args
+        self.loop = asyncio.get_running_loop()
+        # Shared with the network thread; never held while calling publish(), whose
+        # own locks paho also holds while calling _on_publish
+        self.lock = threading.Lock()
+        self.waiting = {}  # mid -> future resolved on PUBACK
+        self.acked_early = set()  # PUBACKs that beat the registration of their mid
+        lon, lat = (float(v) for v in args.location.split(","))
+        self.location = {"type": "Point", "coordinates": [lon, lat]}
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"loadgen-{random.getrandbits(32):08x}")
+        self.client.max_inflight_messages_set(args.concurrency)
+        self.client.on_publish = self._on_publish
+        self.client.connect(args.mqtt_host, args.mqtt_port)
+        self.client.loop_start()
+
+    def _on_publish(self, client, userdata, mid, reason_code=None, properties=None):
+        with self.lock:
+            future = self.waiting.pop(mid, None)
+            if future is None:
+                self.acked_early.add(mid)
+                return
+        self.loop.call_soon_threadsafe(self._resolve, future)
+
+    def topic(self, container_id: str) -> str:
+        # Same partitioning as backend/app/publisher.partition_topic, so workers see their usual topics
+        return f"{self.args.mqtt_topic}/{zlib.crc32(container_id.encode()) % self.args.mqtt_partitions}"
+
+    @staticmethod
+    def _resolve(future):
+        if not future.done():
+            future.set_result(None)
+
+    async def send(self, sensor, measurements: list[tuple[float, int]]) -> int:
+        futures = []
+        for level, ts in measurements:
+            payload = json.dumps({
+                "node_id": self.args.node_id,
+                "container_id": sensor.container_id,
+                "fill_level": level,
+                "location": self.location,
+                "timestamp": datetime.fromtimestamp(ts).isoformat(),
+                "created_at": datetime.now().isoformat(),
+            })
+            info = self.client.publish(self.topic(sensor.container_id), payload, qos=1)
+            if info.rc != 0:
+                return info.rc
+            future = self.loop.create_future()
+            with self.lock:
+                acked = info.mid in self.acked_early
+                if acked:
+                    self.acked_early.discard(info.mid)
+                else:
+                    self.waiting[info.mid] = future
+            if acked:
+                self._resolve(future)
+            futures.append(future)
+        await asyncio.wait_for(asyncio.gather(*futures), self.args.timeout)
+        return 200
+
+    async def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+# --- Sensors ---
+class Sensor:
+    def __init__(self, sensor_id: str, container_id: str, curve: FillCurve):
+        self.sensor_id = sensor_id
+        self.container_id = container_id
+        self.curve = curve
+        self.buffer = []
+
+def next_delay(args, rng: random.Random) -> float:
+    if args.profile == "jitter":
+        return args.interval * rng.uniform(1 - args.jitter, 1 + args.jitter)
+    if args.profile == "burst":
+        # Aligned to the clock, like devices woken by the same RTC schedule
+        return args.interval - time.time() % args.interval
+    return args.interval
+
+def in_outage(args, elapsed: float) -> bool:
+    return args.outage_for > 0 and args.outage_at <= elapsed < args.outage_at + args.outage_for
+
+async def run_sensor(sensor: Sensor, args, target, stats: LatencyStats, semaphore, started: float, stop: asyncio.Event, rng):
+    # Spread first sends over one interval, except in burst mode
+    if args.profile != "burst":
+        await asyncio.sleep(rng.uniform(0, args.interval))
+    while not stop.is_set():
+        sensor.buffer.append((sensor.curve.sample(args.noise, args.spike_rate), int(time.time())))
+        sensor.buffer = sensor.buffer[-args.buffer_limit:]
+
+        if not in_outage(args, time.monotonic() - started):
+            measurements = list(sensor.buffer)
+            async with semaphore:
+                sent_at = time.perf_counter()
+                try:
+                    status = await target.send(sensor, measurements)
+                except Exception as e:
+                    status = type(e).__name__
+                stats.record((time.perf_counter() - sent_at) * 1000, status, len(measurements))
+            # Same as the simulator: keep the measurements unless they were accepted
+            if isinstance(status, int) and status < 300:
+                del sensor.buffer[:len(measurements)]
+
+        try:
+            await asyncio.wait_for(stop.wait(), next_delay(args, rng))
+        except asyncio.TimeoutError:
+            pass
+
+async def report_loop(args, stats: LatencyStats, started: float, stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), args.report_interval)
+        except asyncio.TimeoutError:
+            pass
+        window = stats.take_window()
+        outage = " [outage]" if in_outage(args, time.monotonic() - started) else ""
+        print(f"[{time.monotonic() - started:7.1f}s] {window['rps']} req/s, {window['mps']} meas/s, "
+              f"p50 {window['p50_ms']} ms, p95 {window['p95_ms']} ms, p99 {window['p99_ms']} ms{outage}", flush=True)
+
+async def main(args) -> dict:
+    rng = random.Random(args.seed)
+    curves = [FillCurve(rng, args.time_scale) for _ in range(args.containers)]
+    sensors = [
+        Sensor(f"{args.prefix}-S{i:06d}", f"{args.prefix}-C{i % args.containers:06d}", curves[i % args.containers])
+        for i in range(args.sensors)
+    ]
+    target = MqttTarget(args) if args.target == "mqtt" else HttpTarget(args)
+    stats = LatencyStats(seed=args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    if args.duration:
+        loop.call_later(args.duration, stop.set)
+
+    started = time.monotonic()
+    print(f"Simulating {args.sensors} sensors on {args.containers} containers -> {args.target}, "
+          f"~{args.sensors / args.interval:.0f} req/s offered", flush=True)
+    tasks = [
+        asyncio.create_task(run_sensor(s, args, target, stats, semaphore, started, stop, random.Random(rng.random())))
+        for s in sensors
+    ]
+    reporter = asyncio.create_task(report_loop(args, stats, started, stop))
+    await stop.wait()
+    await asyncio.gather(*tasks, reporter)
+    await target.close()
+
+    elapsed = time.monotonic() - started
+    summary = {
+        "target": args.target,
+        "sensors": args.sensors,
+        "containers": args.containers,
+        "profile": args.profile,
+        "duration_s": round(elapsed, 1),
+        "requests": stats.requests,
+        "measurements": stats.measurements,
+        "rps": round(stats.requests / elapsed, 1),
+        "mps": round(stats.measurements / elapsed, 1),
+        "statuses": dict(stats.statuses),
+        **percentiles(stats.reservoir),
+    }
+    print(json.dumps(summary), flush=True)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Drive N simulated sensors against /push, /api/report or MQTT")
+    parser.add_argument("--target", choices=["push", "report", "mqtt"], default="push")
+    parser.add_argument("--url", default="http://localhost:5000", help="processing node (push) or ingestor (report)")
+    parser.add_argument("--sensors", type=int, default=1000)
+    parser.add_argument("--containers", type=int, default=0, help="default: one container per 3 sensors")
+    parser.add_argument("--interval", type=float, default=3.0, help="seconds between packets of one sensor")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds, 0 runs until interrupted")
+    parser.add_argument("--concurrency", type=int, default=200, help="max requests in flight")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--profile", choices=["steady", "jitter", "burst"], default="steady")
+    parser.add_argument("--jitter", type=float, default=0.5, help="interval spread for the jitter profile")
+    parser.add_argument("--outage-at", type=float, default=0.0, help="seconds after start")
+    parser.add_argument("--outage-for", type=float, default=0.0, help="seconds sensors buffer instead of sending")
+    parser.add_argument("--buffer-limit", type=int, default=10, help="measurements kept per sensor while unsent")
+    parser.add_argument("--time-scale", type=float, default=60.0, help="simulated seconds per real second")
+    parser.add_argument("--noise", type=float, default=1.5, help="reading noise std dev, in %% points")
+    parser.add_argument("--spike-rate", type=float, default=0.02, help="fraction of readings that are echo spikes")
+    parser.add_argument("--node-id", default="NODO-GR-001", help="node reported to the ingestor and MQTT")
+    parser.add_argument("--location", default="-70.7300,-34.0675", help="lon,lat sent with MQTT messages")
+    parser.add_argument("--mqtt-host", default="localhost")
+    parser.add_argument("--mqtt-port", type=int, default=1883)
+    parser.add_argument("--mqtt-topic", default="sced/report", help="base topic, published to <base>/<partition>")
+    parser.add_argument("--mqtt-partitions", type=int, default=16, help="MQTT_PARTITIONS of the ingestor and workers")
+    parser.add_argument("--prefix", default="LOAD", help="prefix of generated sensor and container ids")
+    parser.add_argument("--report-interval", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the final summary to this file")
+    args = parser.parse_args(argv)
+    if args.containers <= 0:
+        args.containers = max(1, args.sensors // 3)
+    return args
+
+if __name__ == "__main__":
+    summary = asyncio.run(main(parse_args()))
+    sys.exit(0 if summary["requests"] else 1)
@@ -52,7 +52,13 @@ while running:
     try:
         response = requests.post(ENDPOINT, json=packet, timeout=5)
         print(f"[{datetime.now()}] Sent packet: {response.status_code}")
-        measurements.clear()
+        if response.status_code < 300:
+            measurements.clear()
+        elif response.status_code < 500:
+            # Rejected (e.g. 422 or 413): the same packet would fail again
+            print(f"[{datetime.now()}] Dropping {len(measurements)} measurements: {response.text[:200]}")
+            measurements.clear()
+        # On 5xx (e.g. 503, node queue full) keep the measurements and resend them next time
     except requests.exceptions.RequestException as e:
         print(f"[{datetime.now()}] Error sending data: {e}")
         print(measurements)
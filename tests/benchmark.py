@@ -0,0 +1,345 @@
+"""
+End-to-end benchmark of the pipeline, stage by stage.
+
+Runs against the stack of docker-compose.test.yml on one box (PostGIS,
+Mosquitto, worker, ingestor, backend and the processing node):
+
+    docker compose -f docker-compose.test.yml up -d --build postgis mqtt worker ingestor backend processing_node
+    python tests/benchmark.py --output benchmarks/run.json
+    python tests/benchmark.py --compare benchmarks/baseline.json
+
+Stages:
+    push         sensors -> processing node /push (load generator)
+    aggregation  window close cycle on the node, and edge -> central latency
+    report       uplink-style traffic -> ingestor /api/report
+    mqtt         broker -> worker -> container_readings insert
+    readings     /api/readings and /api/readings/rollup at several dataset sizes
+
+Results are written as JSON; --compare flags metrics that got worse than a
+previous run by more than --threshold and exits non-zero.
+Benchmark rows use ids prefixed with BENCH- and are deleted afterwards.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+import psycopg2
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "sensor-sim"))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+PROCESSING_NODE_URL = os.getenv("PROCESSING_NODE_URL", "http://localhost:5000")
+INGESTOR_URL = os.getenv("INGESTOR_URL", "http://localhost:8000")
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8001")
+MQTT_HOST = os.getenv("MQTT_HOST", "localhost")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+MQTT_TOPIC = os.getenv("MQTT_TOPIC", "sced/report")
+NODE_ID = os.getenv("BENCH_NODE_ID", "NODO-GR-001")  # must exist with a location (sample data)
+NODE_LOCATION = {"type": "Point", "coordinates": [-70.7300, -34.0675]}
+
+STAGES = ["push", "aggregation", "report", "mqtt", "readings"]
+# Direction of each metric for --compare; metrics not listed are informational
+HIGHER_IS_BETTER = ("rps", "mps", "per_s")
+LOWER_IS_BETTER = ("_ms", "lag_seconds", "latency_s")
+
+def db_connect():
+    return psycopg2.connect(
+        host=os.getenv("POSTGRES_HOST", "localhost"),
+        port=os.getenv("POSTGRES_PORT", "5432"),
+        dbname=os.getenv("POSTGRES_DB", "sced"),
+        user=os.getenv("POSTGRES_USER", "sced_user"),
+        password=os.getenv("POSTGRES_PASSWORD", "securepass"),
+    )
+
+def timed(fn, repeat: int) -> dict:
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - started) * 1000)
+    return summarize(durations)
+
+def summarize(values_ms: list[float]) -> dict:
+    if len(values_ms) < 2:
+        value = round(values_ms[0], 1) if values_ms else None
+        return {"p50_ms": value, "p95_ms": value, "p99_ms": value}
+    q = statistics.quantiles(values_ms, n=100, method="inclusive")
+    return {"p50_ms": round(q[49], 1), "p95_ms": round(q[94], 1), "p99_ms": round(q[98], 1)}
+
+def run_loadgen(argv: list[str]) -> dict:
+    import loadgen
+    return asyncio.run(loadgen.main(loadgen.parse_args(argv + ["--report-interval", "10"])))
+
+# --- Stages ---
+def bench_push(args, run_id: str) -> dict:
+    return run_loadgen([
+        "--target", "push", "--url", PROCESSING_NODE_URL,
+        "--sensors", str(args.sensors), "--interval", str(args.interval),
+        "--duration", str(args.duration), "--prefix", f"BENCH-E{run_id}",
+    ])
+
+def bench_aggregation(args, run_id: str) -> dict:
+    """Node-side window stats, then how long until every pushed container shows up centrally."""
+    prefix = f"BENCH-E{run_id}"
+    containers = max(1, args.sensors // 3)
+    started = time.monotonic()
+    seen = 0
+    while time.monotonic() - started < args.timeout:
+        latest = requests.get(f"{BACKEND_URL}/api/containers/latest", params={"node_id": NODE_ID}, timeout=30).json()
+        seen = sum(1 for row in latest if row["container_id"].startswith(prefix))
+        if seen >= containers:
+            break
+        time.sleep(1)
+    node = requests.get(f"{PROCESSING_NODE_URL}/stats", timeout=10).json()
+    aggregation = node.get("aggregation", {})
+    return {
+        "window_seconds": aggregation.get("window_seconds"),
+        "cycle_ms": aggregation.get("last_cycle_ms"),
+        "lag_seconds": aggregation.get("lag_seconds"),
+        "windows_skipped": aggregation.get("windows_skipped"),
+        "late_levels": aggregation.get("late_levels"),
+        "outbox_pending": node.get("outbox", {}).get("pending"),
+        "containers_expected": containers,
+        "containers_seen": seen,
+        # From the end of the push stage to the last container visible in /api/containers/latest
+        "edge_to_central_latency_s": round(time.monotonic() - started, 1),
+    }
+
+def bench_report(args, run_id: str) -> dict:
+    return run_loadgen([
+        "--target", "report", "--url", INGESTOR_URL, "--node-id", NODE_ID,
+        "--sensors", str(args.sensors), "--interval", str(args.interval),
+        "--duration", str(args.duration), "--prefix", f"BENCH-R{run_id}",
+    ])
+
+def bench_mqtt(args, run_id: str) -> dict:
+    """Publish worker-format messages and time their arrival in container_readings."""
+    import paho.mqtt.client as mqtt
+
+    prefix = f"BENCH-M{run_id}"
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"bench-{run_id}")
+    client.max_inflight_messages_set(1000)
+    client.connect(MQTT_HOST, MQTT_PORT)
+    client.loop_start()
+
+    started = time.monotonic()
+    last = None
+    for i in range(args.messages):
+        # Naive UTC like the worker's clock in the containers; latency = received_at - timestamp
+        now = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+        last = client.publish(MQTT_TOPIC, json.dumps({
+            "node_id": NODE_ID,
+            "container_id": f"{prefix}-{i % 100:03d}",
+            "fill_level": float(i % 100),
+            "location": NODE_LOCATION,
+            "timestamp": now,
+            "created_at": now,
+        }), qos=1)
+    last.wait_for_publish(args.timeout)
+    published_s = time.monotonic() - started
+
+    with db_connect() as conn:
+        with conn.cursor() as cur:
+            stored = 0
+            while time.monotonic() - started < args.timeout:
+                cur.execute("SELECT count(*) FROM container_readings WHERE container_id LIKE %s", (prefix + "%",))
+                stored = cur.fetchone()[0]
+                conn.commit()
+                if stored >= args.messages:
+                    break
+                time.sleep(0.2)
+            stored_s = time.monotonic() - started
+            cur.execute("""
+                SELECT percentile_cont(ARRAY[0.5, 0.95, 0.99]) WITHIN GROUP (
+                    ORDER BY extract(epoch FROM received_at - timestamp) * 1000
+                )
+                FROM container_readings WHERE container_id LIKE %s
+            """, (prefix + "%",))
+            p50, p95, p99 = cur.fetchone()[0] or (None, None, None)
+    client.loop_stop()
+    client.disconnect()
+    return {
+        "messages": args.messages,
+        "stored": stored,
+        "publish_per_s": round(args.messages / published_s, 1),
+        "insert_per_s": round(stored / stored_s, 1),
+        "p50_ms": p50 and round(p50, 1),
+        "p95_ms": p95 and round(p95, 1),
+        "p99_ms": p99 and round(p99, 1),
+    }
+
+def seed_readings(cur, prefix: str, have: int, want: int, days: int = 30):
+    """Grow the benchmark dataset to `want` readings over 100 containers and the last `days` days."""
+    from app.partitions import create_partitions
+    from app.rollups import rebuild_rollups
+
+    now = datetime.now().replace(microsecond=0)
+    create_partitions(cur, (now - timedelta(days=days)).date(), now.date())
+    cur.execute("""
+        INSERT INTO containers (id, node_id, zone_id, type, location, created_at)
+        SELECT %s || lpad(g::text, 3, '0'), p.id, p.zone_id, 'benchmark', p.location, now()
+        FROM processor_nodes p, generate_series(0, 99) g
+        WHERE p.id = %s
+        ON CONFLICT (id) DO NOTHING
+    """, (prefix, NODE_ID))
+    step = days * 86400 / want
+    cur.execute("""
+        INSERT INTO container_readings (container_id, fill_level, timestamp, received_at)
+        SELECT %s || lpad((g %% 100)::text, 3, '0'), random() * 100, ts, ts
+        FROM generate_series(%s, %s) g,
+             LATERAL (SELECT %s::timestamp - make_interval(secs => g * %s)) AS t (ts)
+    """, (prefix, have, want - 1, now, step))
+    rebuild_rollups(cur, now - timedelta(days=days), now)
+
+def bench_readings(args, run_id: str) -> dict:
+    prefix = f"BENCH-Q{run_id}-"
+    results = {}
+    have = 0
+    with db_connect() as conn:
+        for size in args.sizes:
+            with conn.cursor() as cur:
+                seed_readings(cur, prefix, have, size)
+                cur.execute("ANALYZE container_readings")
+            conn.commit()
+            have = size
+
+            container = prefix + "007"
+            middle = (datetime.now() - timedelta(days=15)).isoformat()
+            queries = {
+                "latest_page": ("/api/readings", {"limit": 1000}),
+                "container_page": ("/api/readings", {"container_id": container, "limit": 1000}),
+                "container_window": ("/api/readings", {"container_id": container, "timestamp": middle, "range_seconds": 3600}),
+                "rollup_30d": ("/api/readings/rollup", {
+                    "container_id": container,
+                    "from": (datetime.now() - timedelta(days=30)).isoformat(),
+                }),
+            }
+            results[str(size)] = {
+                name: timed(lambda path=path, params=params: requests.get(
+                    BACKEND_URL + path, params=params, timeout=60
+                ).raise_for_status(), args.repeat)
+                for name, (path, params) in queries.items()
+            }
+            print(f"readings @ {size}: {json.dumps(results[str(size)])}", flush=True)
+    return results
+
+def cleanup(run_id: str):
+    with db_connect() as conn:
+        with conn.cursor() as cur:
+            like = f"BENCH-%{run_id}%"
+            for table in ("container_readings", "container_rollups", "container_latest", "container_forecast"):
+                cur.execute(f"DELETE FROM {table} WHERE container_id LIKE %s", (like,))
+            cur.execute("DELETE FROM containers WHERE id LIKE %s", (like,))
+
+# --- Results ---
+def metadata() -> dict:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+
+def flatten(data: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Metrics that got worse than the baseline by more than threshold (a fraction)."""
+    now = flatten(current["stages"])
+    before = flatten(baseline["stages"])
+    regressions = []
+    for name, value in sorted(now.items()):
+        old = before.get(name)
+        if not old:
+            continue
+        change = (value - old) / old
+        leaf = name.rsplit(".", 1)[-1]
+        if leaf.endswith(HIGHER_IS_BETTER):
+            worse = -change
+        elif leaf.endswith(LOWER_IS_BETTER):
+            worse = change
+        else:
+            continue
+        marker = "REGRESSION" if worse > threshold else ""
+        print(f"{name:55} {old:>12} -> {value:>12} ({change:+.1%}) {marker}")
+        if worse > threshold:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"comma separated subset of {','.join(STAGES)}")
+    parser.add_argument("--sensors", type=int, default=2000)
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between packets of one sensor")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per load stage")
+    parser.add_argument("--messages", type=int, default=20000, help="MQTT messages published")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="dataset sizes for the readings stage")
+    parser.add_argument("--repeat", type=int, default=20, help="requests per query and dataset size")
+    parser.add_argument("--timeout", type=float, default=180.0, help="seconds to wait for data to arrive")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", f"run-{datetime.now():%Y%m%d-%H%M%S}.json"))
+    parser.add_argument("--compare", help="previous results file")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown before flagging, as a fraction")
+    parser.add_argument("--keep-data", action="store_true", help="do not delete the BENCH- rows afterwards")
+    args = parser.parse_args(argv)
+    args.sizes = sorted(int(size) for size in args.sizes.split(","))
+    stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    run_id = uuid.uuid4().hex[:6]
+    results = {"meta": metadata(), "config": {k: v for k, v in vars(args).items() if k != "compare"}, "stages": {}}
+    bench = {
+        "push": bench_push,
+        "aggregation": bench_aggregation,
+        "report": bench_report,
+        "mqtt": bench_mqtt,
+        "readings": bench_readings,
+    }
+    try:
+        for stage in STAGES:
+            if stage in stages:
+                print(f"=== {stage} ===", flush=True)
+                results["stages"][stage] = bench[stage](args, run_id)
+    finally:
+        if not args.keep_data:
+            cleanup(run_id)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,40 +4,56 @@ Simulates sending data from a sensor to the processing node,
 then checks that the backend server has received and stored it.
 """
 
+import filecmp
 import os
 import time
 import requests
 from datetime import datetime
 
 # Config
-PROCESSING_NODE_URL = os.getenv("PROCESSING_NODE_URL", "http://localhost:8001")
-BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
+PROCESSING_NODE_URL = os.getenv("PROCESSING_NODE_URL", "http://localhost:5000")
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8001")
+TIMEOUT = int(os.getenv("SYSTEM_TEST_TIMEOUT", "180"))  # at least one aggregation window plus lateness
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules both images need; each build context only sees its own directory
+SHARED_MODULES = ["wire.py", "metrics.py"]
+
+def test_shared_modules():
+    # No services needed: fails as soon as one copy is edited without the other
+    for name in SHARED_MODULES:
+        backend = os.path.join(ROOT, "backend", "app", name)
+        node = os.path.join(ROOT, "processing-node", name)
+        assert filecmp.cmp(backend, node, shallow=False), f"backend/app/{name} and processing-node/{name} differ"
+    print("✅ Shared modules are identical.")
 
 def test_flow():
     # 1️⃣ Simular sensor -> processing_node
     sensor_payload = {
         "sensor_id": "test_sensor",
+        "container_id": "container_test_sensor",
         "measurements": [
             {"fill_level": 55.5, "timestamp": int(datetime.now().timestamp())}
         ]
     }
     r1 = requests.post(f"{PROCESSING_NODE_URL}/push", json=sensor_payload)
-    assert r1.status_code == 200
+    assert r1.status_code in (200, 202)
     print("✅ Sensor data sent to processing node.")
 
     # 2️⃣ Esperar a que el processing_node agregue y envíe al backend
     print("⏳ Waiting for processing and sending to backend...")
-    time.sleep(10)  # depende de tu tiempo de agregación (mínimo 5 min en producción)
-
-    # 3️⃣ Consultar backend para verificar datos
-    r2 = requests.get(f"{BACKEND_URL}/api/contenedores")
-    assert r2.status_code == 200
-    data = r2.json()
-    assert any(
-        entry["container_id"] == f"container_{sensor_payload['sensor_id']}"
-        for entry in data
-    )
+    deadline = time.time() + TIMEOUT
+    while True:
+        # 3️⃣ Consultar backend para verificar datos
+        r2 = requests.get(f"{BACKEND_URL}/api/containers/latest")
+        assert r2.status_code == 200
+        data = r2.json()
+        if any(entry["container_id"] == sensor_payload["container_id"] for entry in data):
+            break
+        assert time.time() < deadline, "Data did not reach the backend in time"
+        time.sleep(5)
     print("✅ Backend received and stored data.")
 
 if __name__ == "__main__":
+    test_shared_modules()
     test_flow()